@@ -1,85 +1,130 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, g, stream_with_context
 from flask_cors import CORS
 import sqlite3
 import json
+import gzip
 import boto3
-import base64
 import os
-import random
+import time
 import jwt
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from botocore.exceptions import NoCredentialsError, ClientError
 from botocore.config import Config
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+import bedrock
+import chunking
+import db
+import html_pipeline
+import images
+import metrics
+import pages
+import prompts
+import publish
+from jobs import InvalidCallbackError, JobQueue, QueueFullError, public_job
+from llm_cache import create_cache, make_cache_key
+from metrics import logger
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
 app = Flask(__name__)
 CORS(app)
 REGION = "us-east-1"
 
-try:
-    custom_config = Config(connect_timeout=10, read_timeout=600)
-    client = boto3.client("bedrock-runtime", region_name=REGION, config=custom_config)
-    s3 = boto3.client("s3", region_name=REGION)
-except NoCredentialsError:
-    print("AWS credentials not found. Please configure your AWS credentials.")
-    exit(1)
-
 claude_model_id = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
 image_model_id = "amazon.nova-canvas-v1:0"
 AWS_BUCKET_NAME = "webbucket.new"
 SECRET_KEY = "your-secret-key"
 
-# Initialize SQLite Database
-def init_db():
-    conn = sqlite3.connect('blog_content.db')
-    cursor = conn.cursor()
-
-    # Users table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL
-    )''')
-
-    # Topics table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS topics (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        title TEXT NOT NULL,
-        FOREIGN KEY (user_id) REFERENCES users(id)
-    )''')
-
-    # Blogs table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS blogs (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        topic_id INTEGER,
-        blog_title TEXT,
-        title TEXT,
-        introduction TEXT,
-        body TEXT,
-        FOREIGN KEY (user_id) REFERENCES users(id),
-        FOREIGN KEY (topic_id) REFERENCES topics(id)
-    )''')
-
-    # Webpages table (store full HTML content)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS webpages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        topic_id INTEGER,
-        html_content TEXT NOT NULL,
-        FOREIGN KEY (user_id) REFERENCES users(id),
-        FOREIGN KEY (topic_id) REFERENCES topics(id)
-    )''')
-
-    conn.commit()
-    conn.close()
-
-init_db()
+# Account quotas per model; requests wait for capacity instead of being throttled
+bedrock_limits = {
+    claude_model_id: (int(os.environ.get("BEDROCK_CLAUDE_RPM", "100")), int(os.environ.get("BEDROCK_CLAUDE_TPM", "200000"))),
+    image_model_id: (int(os.environ.get("BEDROCK_IMAGE_RPM", "60")), None),
+}
+
+client = None
+s3 = None
+
+# Set the Bedrock and S3 clients used by every route. Tests and benchmarks pass
+# in fakes; otherwise real boto3 clients are built (fakes when BLOG_FAKE_AWS=1).
+# Bedrock calls go through bedrock.AdaptiveClient, which owns retries.
+def init_clients(bedrock_client=None, s3_client=None):
+    global client, s3
+    if os.environ.get("BLOG_FAKE_AWS") == "1":
+        from fakes import FakeBedrockClient, FakeS3Client
+        bedrock_client = bedrock_client or FakeBedrockClient()
+        s3_client = s3_client or FakeS3Client()
+    if bedrock_client is None:
+        custom_config = Config(connect_timeout=10, read_timeout=600, retries={"total_max_attempts": 1})
+        bedrock_client = boto3.client("bedrock-runtime", region_name=REGION, config=custom_config)
+    if s3_client is None:
+        s3_client = boto3.client("s3", region_name=REGION, config=Config(max_pool_connections=32))
+    client = bedrock.AdaptiveClient(
+        metrics.instrument_client(bedrock_client, "bedrock"),
+        limits=bedrock_limits,
+        max_retries=int(os.environ.get("BEDROCK_MAX_RETRIES", "4")),
+        max_wait=float(os.environ.get("BEDROCK_MAX_WAIT", "30")),
+    )
+    s3 = metrics.instrument_client(s3_client, "s3")
+
+init_clients()
+if os.environ.get("BLOG_FAKE_AWS") != "1" and boto3.Session().get_credentials() is None:
+    logger.warning("AWS credentials not found. Bedrock and S3 calls will fail until they are configured.")
+
+# Request payloads are logged for a sample of requests, truncated (LOG_SAMPLE_RATE=1 logs all)
+log_payload = metrics.PayloadLogger(
+    sample_rate=float(os.environ.get("LOG_SAMPLE_RATE", "0.01")),
+    max_chars=int(os.environ.get("LOG_MAX_CHARS", "500")),
+)
+MAX_IMAGES_PER_REQUEST = 20
+
+# Shared pool for image model calls and S3 uploads
+image_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("IMAGE_WORKERS", "8")))
+# Pool for publishing pages to S3, sized to stay within the S3 client's connection pool
+publish_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("PUBLISH_WORKERS", "16")))
+PUBLISH_ENCODING = os.environ.get("PUBLISH_ENCODING", "gzip")
+# Pool for per-section Claude calls in section mode
+section_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("SECTION_WORKERS", "4")))
+# Content at least this long is edited section by section unless the request opts out
+SECTION_MODE_MIN_CHARS = int(os.environ.get("SECTION_MODE_MIN_CHARS", "12000"))
+
+# Cache for Claude responses (LLM_CACHE_BACKEND=memory|sqlite)
+llm_cache = create_cache(
+    backend=os.environ.get("LLM_CACHE_BACKEND", "memory"),
+    ttl=int(os.environ.get("LLM_CACHE_TTL", "3600")),
+    max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "256")),
+)
+
+db.init_db()
+pages.init_db()
+
+# Request latency per route; streamed responses are timed until their headers are sent
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.pop("request_start", None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.request_duration.observe(
+            time.perf_counter() - start, route=route, method=request.method, status=response.status_code
+        )
+        if response.status_code >= 500:
+            metrics.request_errors.inc(route=route, method=request.method)
+    return response
+
+# Prometheus metrics
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+def llm_cache_samples():
+    stats = llm_cache.stats()
+    return [({"result": "hit"}, stats["hits"]), ({"result": "miss"}, stats["misses"])]
+
+metrics.registry.callback("llm_cache_lookups_total", "LLM response cache lookups by result", llm_cache_samples, "counter")
+metrics.registry.callback("job_queue_pending", "Jobs waiting for a worker", lambda: [({}, job_queue.pending())])
 
 # Authentication middleware
 def token_required(f):
@@ -105,17 +150,11 @@ def register():
     password = data.get("password")
     if not username or not password:
         return jsonify({"error": "Username and password are required"}), 400
-    conn = sqlite3.connect('blog_content.db')
-    cursor = conn.cursor()
     try:
-        cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)",
-                       (username, generate_password_hash(password)))
-        conn.commit()
+        db.create_user(username, generate_password_hash(password))
         return jsonify({"message": "User registered successfully"}), 201
     except sqlite3.IntegrityError:
         return jsonify({"error": "Username already exists"}), 400
-    finally:
-        conn.close()
 
 # User Login
 @app.route('/api/login', methods=['POST'])
@@ -123,11 +162,7 @@ def login():
     data = request.json
     username = data.get("username")
     password = data.get("password")
-    conn = sqlite3.connect('blog_content.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, password FROM users WHERE username = ?", (username,))
-    user = cursor.fetchone()
-    conn.close()
+    user = db.get_user_by_username(username)
     if not user or not check_password_hash(user[1], password):
         return jsonify({"error": "Invalid credentials"}), 401
     token = jwt.encode({"user_id": user[0], "exp": datetime.utcnow() + timedelta(hours=24)},
@@ -138,39 +173,324 @@ def login():
 @app.route('/api/topics', methods=['GET', 'POST'])
 @token_required
 def manage_topics():
-    conn = sqlite3.connect('blog_content.db')
-    cursor = conn.cursor()
     if request.method == 'GET':
         user_id = request.args.get("user_id")
-        cursor.execute("SELECT id, title FROM topics WHERE user_id = ?", (user_id,))
-        topics = [{"id": row[0], "title": row[1]} for row in cursor.fetchall()]
-        conn.close()
+        topics = db.list_topics(user_id)
         return jsonify({"topics": topics})
     if request.method == 'POST':
         data = request.json
         user_id = data.get("user_id")
         title = data.get("title")
-        cursor.execute("INSERT INTO topics (user_id, title) VALUES (?, ?)", (user_id, title))
-        topic_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        topic_id = db.create_topic(user_id, title)
         return jsonify({"topic_id": topic_id, "message": "Topic created successfully"}), 201
 
-# Function to invoke Claude AI
-def invoke_claude(prompt):
-    messages = [{"role": "user", "content": [{"text": prompt}]}]
-    system_prompts = [{"text": "Try generate the content or code within 4500 tokens"}]
-    inference_config = {"maxTokens": 5000, "temperature": 0.5, "topP": 0.9}
+# Function to invoke Claude AI. Prompts come from prompts.registry: the static
+# template text goes in the system block, ahead of a prompt-cache checkpoint.
+claude_inference_config = {"maxTokens": 5000, "temperature": 0.5, "topP": 0.9}
+
+def claude_cache_key(prompt):
+    return make_cache_key(claude_model_id, prompt.messages, claude_inference_config, prompt.system)
+
+# Continuation calls allowed when a reply stops at maxTokens
+MAX_CONTINUATIONS = int(os.environ.get("CLAUDE_MAX_CONTINUATIONS", "3"))
+
+def assistant_prefill(text):
+    # Bedrock rejects a final assistant turn that ends in whitespace
+    return {"role": "assistant", "content": [{"text": text.rstrip()}]}
+
+# One Claude reply for a prompts.RenderedPrompt, assembled across calls: a reply that
+# stops at maxTokens is continued by prefilling it as the assistant turn so the model
+# picks up where it stopped. Shared by the blocking and the asyncio code, which only
+# make the calls: each item of requests() is the keyword arguments for converse (feed
+# the response to add_response) or converse_stream (feed each event to add_event, and
+# send flush() after the last call).
+class ClaudeReply:
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.parts = []
+        # Trailing whitespace of the stream, held back until more text follows since a
+        # continuation drops it, as add_response does
+        self.pending = ""
+        self.stop_reason = None
+        self.start = time.perf_counter()
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    def requests(self):
+        for _ in range(MAX_CONTINUATIONS + 1):
+            messages = self.prompt.messages
+            if self.parts:
+                messages = messages + [assistant_prefill(self.text)]
+            self.pending = ""
+            self.stop_reason = None
+            yield {
+                "modelId": claude_model_id,
+                "messages": messages,
+                "system": self.prompt.system,
+                "inferenceConfig": claude_inference_config,
+            }
+            if self.stop_reason != "max_tokens":
+                return
+
+    def add_response(self, response):
+        metrics.record_usage(claude_model_id, response.get("usage"), self.prompt.name)
+        self.stop_reason = response.get("stopReason")
+        if self.parts:
+            self.parts = [self.text.rstrip()]
+        self.parts.append(response["output"]["message"]["content"][0]["text"])
+
+    # Returns the text to send for the event, if any
+    def add_event(self, event):
+        if "contentBlockDelta" in event:
+            text = event["contentBlockDelta"]["delta"].get("text")
+            if text:
+                if not self.parts and not self.pending:
+                    metrics.time_to_first_token.observe(time.perf_counter() - self.start, model=claude_model_id)
+                text = self.pending + text
+                stripped = text.rstrip()
+                self.pending = text[len(stripped):]
+                if stripped:
+                    self.parts.append(stripped)
+                    return stripped
+        elif "messageStop" in event:
+            self.stop_reason = event["messageStop"].get("stopReason")
+        elif "metadata" in event:
+            metrics.record_usage(claude_model_id, event["metadata"].get("usage"), self.prompt.name)
+        return None
+
+    # Whitespace still held back once the reply is complete
+    def flush(self):
+        text, self.pending = self.pending, ""
+        if text:
+            self.parts.append(text)
+        return text
+
+# Claude reply for a prompts.RenderedPrompt. Raises bedrock.BedrockError.
+def invoke_claude(prompt, use_cache=True):
+    cache_key = claude_cache_key(prompt)
+    if use_cache:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    reply = ClaudeReply(prompt)
+    for kwargs in reply.requests():
+        reply.add_response(client.converse(**kwargs))
+    llm_cache.set(cache_key, reply.text)
+    return reply.text
+
+# Stream Claude output as text deltas using the converse-stream API
+def invoke_claude_stream(prompt, use_cache=True):
+    cache_key = claude_cache_key(prompt)
+    if use_cache:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+    reply = ClaudeReply(prompt)
+    for kwargs in reply.requests():
+        for event in client.converse_stream(**kwargs)["stream"]:
+            text = reply.add_event(event)
+            if text:
+                yield text
+    text = reply.flush()
+    if text:
+        yield text
+    llm_cache.set(cache_key, reply.text)
+
+# JSON body, status and headers for a failed Bedrock call
+def bedrock_error(error):
+    headers = {"Retry-After": str(error.retry_after)} if isinstance(error, bedrock.ThrottledError) else {}
+    return {"error": str(error)}, error.status, headers
+
+def bedrock_error_response(error):
+    body, status, headers = bedrock_error(error)
+    return jsonify(body), status, headers
+
+def error_event(error):
+    return sse_event({"error": str(error), "status": getattr(error, "status", 500)}, event="error")
+
+# Format a server-sent event
+def sse_event(payload, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(payload)}\n\n"
+
+# Send Claude deltas as server-sent events, ending with the assembled text
+def stream_claude_response(prompt, result_key, use_cache=True):
+    def generate():
+        parts = []
+        try:
+            for text in invoke_claude_stream(prompt, use_cache=use_cache):
+                parts.append(text)
+                yield sse_event({"delta": text})
+        except Exception as e:
+            yield error_event(e)
+            return
+        yield sse_event({result_key: "".join(parts)}, event="done")
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+
+# Streaming is requested with {"stream": true} in the body or ?stream=1
+def wants_stream(data, args):
+    return bool(data.get("stream")) or args.get("stream") in ("1", "true")
+
+# The response cache is skipped with {"no_cache": true} in the body or ?no_cache=1
+def wants_cache(data, args):
+    return not (data.get("no_cache") or args.get("no_cache") in ("1", "true"))
+
+# Job mode is requested with {"async": true} in the body or ?mode=job
+def wants_job(data, args):
+    return bool(data.get("async")) or args.get("mode") == "job"
+
+# Queue a generation job, returning the JSON body and status to answer with
+def submit_job(user_id, kind, payload, data):
+    callback_url = data.get("callback_url")
+    if callback_url is not None and not isinstance(callback_url, str):
+        return {"error": "callback_url must be an http(s) URL"}, 400
     try:
-        response = client.converse(
-            modelId=claude_model_id,
-            messages=messages,
-            system=system_prompts,
-            inferenceConfig=inference_config,
-        )
-        return response["output"]["message"]["content"][0]["text"]
-    except Exception as e:
-        return str(e)
+        job_id = job_queue.submit(user_id, kind, payload, callback_url)
+    except InvalidCallbackError as e:
+        return {"error": str(e)}, 400
+    except QueueFullError as e:
+        return {"error": str(e)}, 503
+    return {"job_id": job_id, "status": "queued", "status_url": f"/api/jobs/{job_id}"}, 202
+
+# Queue a generation job and return its id straight away
+def enqueue_job(kind, payload, data):
+    body, status = submit_job(request.user_id, kind, payload, data)
+    return jsonify(body), status
+
+# A request the generation routes cannot serve; answered with a 400
+class RequestError(ValueError):
+    pass
+
+# Body and query options of /api/generate, shared by the Flask and ASGI routes.
+# Raises RequestError.
+def parse_generate_request(data, args):
+    content = data.get("content", "")
+    prompt = data.get("prompt")
+    section_ids = data.get("section_ids")
+    if section_ids is not None and not (isinstance(section_ids, list) and all(isinstance(i, int) for i in section_ids)):
+        raise RequestError("section_ids must be a list of integers")
+    if section_ids and not content:
+        raise RequestError("section_ids need content to edit")
+    if section_ids and data.get("sections") is False:
+        raise RequestError("section_ids cannot be used with sections disabled")
+    use_sections = wants_sections(data, content)
+    try:
+        plan = plan_sections(content, prompt, section_ids) if use_sections else None
+    except chunking.SectionNotFound as e:
+        raise RequestError(str(e))
+    use_sections = plan is not None
+    use_cache = wants_cache(data, args)
+    return {
+        "prompt": prompt,
+        "plan": plan,
+        "claude_prompt": None if use_sections else build_generate_prompt(content, prompt),
+        "use_cache": use_cache,
+        "stream": wants_stream(data, args),
+        "job": wants_job(data, args),
+        "job_payload": {"content": content, "prompt": prompt, "no_cache": not use_cache,
+                        "sections": use_sections, "section_ids": section_ids},
+    }
+
+# Body and query options of /api/generate_template. Raises RequestError.
+def parse_template_request(data, args):
+    if not data.get("user_id") or not data.get("topic_id"):
+        raise RequestError("User ID and Topic ID are required")
+    additional_prompt = data.get("additional_prompt", "")
+    use_cache = wants_cache(data, args)
+    return {
+        "claude_prompt": build_template_prompt(additional_prompt),
+        "use_cache": use_cache,
+        "stream": wants_stream(data, args),
+        "job": wants_job(data, args),
+        "job_payload": {"additional_prompt": additional_prompt, "no_cache": not use_cache},
+    }
+
+def build_generate_prompt(content, prompt):
+    return prompts.registry.render("generate", content=content or "No content provided", prompt=prompt)
+
+def build_section_prompt(section, prompt):
+    return prompts.registry.render(
+        "generate_section", heading=section["heading"] or "(none)", section=section["text"], prompt=prompt
+    )
+
+# Section mode is requested with {"sections": true} or by choosing section_ids, and is
+# the default for long content. Prompts about the styles or <head> need the whole
+# document unless sections were chosen.
+def wants_sections(data, content):
+    if not content:
+        return False
+    if data.get("section_ids"):
+        return True
+    if chunking.targets_document(data.get("prompt")):
+        return False
+    if data.get("sections") is None:
+        return len(content) >= SECTION_MODE_MIN_CHARS
+    return bool(data.get("sections"))
+
+# Split the content and pick the sections to edit; a prompt that names no section
+# edits all of them, or returns None (edit the whole document) when text outside the
+# sections would be left untouched. Raises chunking.SectionNotFound for sections the
+# content lacks.
+def plan_sections(content, prompt, section_ids=None):
+    head, sections, tail = chunking.split_document(content)
+    targets = chunking.select_sections(sections, prompt, section_ids)
+    if not targets:
+        if chunking.has_visible_text(head) or chunking.has_visible_text(tail):
+            return None
+        targets = [s["id"] for s in sections]
+    return head, sections, tail, set(targets)
+
+# (section_id, section prompt) for each section the plan edits
+def section_prompts(plan, prompt):
+    _, sections, _, targets = plan
+    return [(s["id"], build_section_prompt(s, prompt)) for s in sections if s["id"] in targets]
+
+def section_summary(plan):
+    _, sections, _, targets = plan
+    return [{"id": s["id"], "heading": s["heading"], "edited": s["id"] in targets} for s in sections]
+
+def stitch_sections(plan, replacements):
+    head, sections, tail, _ = plan
+    return chunking.stitch(head, sections, replacements, tail)
+
+# Edit the planned sections concurrently, yielding (section_id, new_text) as each one finishes
+def iter_section_edits(plan, prompt, use_cache=True):
+    futures = {
+        section_executor.submit(invoke_claude, section_prompt, use_cache): section_id
+        for section_id, section_prompt in section_prompts(plan, prompt)
+    }
+    try:
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+def generate_by_sections(plan, prompt, use_cache=True):
+    replacements = dict(iter_section_edits(plan, prompt, use_cache=use_cache))
+    return {"content": stitch_sections(plan, replacements), "sections": section_summary(plan)}
+
+# Send each edited section as a "section" event, ending with the stitched content
+def stream_sections_response(plan, prompt, use_cache=True):
+    def generate():
+        yield sse_event({"sections": section_summary(plan)}, event="plan")
+        replacements = {}
+        try:
+            for section_id, text in iter_section_edits(plan, prompt, use_cache=use_cache):
+                replacements[section_id] = text
+                yield sse_event({"id": section_id, "content": text}, event="section")
+        except Exception as e:
+            yield error_event(e)
+            return
+        yield sse_event({"content": stitch_sections(plan, replacements)}, event="done")
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
 
 # Generate/Modify Blog Content
 @app.route('/api/generate', methods=['POST'])
@@ -181,7 +501,7 @@ def generate_or_modify_blog():
     topic_id = data.get('topic_id')
     content = data.get('content', '')
     prompt = data.get('prompt')
-    print("Received data:", data)
+    log_payload("Received data", data)
     # if not user_id or not topic_id or not prompt:
     #     return jsonify({"error": "User ID, Topic ID, and prompt are required"}), 400
 
@@ -196,58 +516,122 @@ def generate_or_modify_blog():
 
     # topic = topic_row[0]
     # print("TOPIC",topic)
-    print("CONTENT",content)
-    
+    log_payload("CONTENT", content)
+
+    try:
+        options = parse_generate_request(data, request.args)
+    except RequestError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if options["job"]:
+        return enqueue_job("generate", options["job_payload"], data)
+
+    if options["plan"]:
+        if options["stream"]:
+            return stream_sections_response(options["plan"], prompt, use_cache=options["use_cache"])
+        try:
+            return jsonify(generate_by_sections(options["plan"], prompt, use_cache=options["use_cache"]))
+        except bedrock.BedrockError as e:
+            return bedrock_error_response(e)
+
     # Generate or modify content
-    claude_prompt = (
-        f"System: You are a content generation/modification bot. "
-        f"Generate new content if no original content is provided, or modify the provided content based on the prompt. "
-        f"Output only the modified or generated content.\n\n"
-        f"Original content: {content if content else 'No content provided'}\n"
-        f"Prompt: {prompt}"
-    )
+    if options["stream"]:
+        return stream_claude_response(options["claude_prompt"], "content", use_cache=options["use_cache"])
 
-    new_content = invoke_claude(claude_prompt)
-    print(f"Claude response: {new_content}")
-    if not new_content or isinstance(new_content, str) and "error" in new_content.lower():
-        return jsonify({"error": "Failed to generate/modify content"}), 500
+    try:
+        new_content = invoke_claude(options["claude_prompt"], use_cache=options["use_cache"])
+    except bedrock.BedrockError as e:
+        return bedrock_error_response(e)
+    log_payload("Claude response", new_content)
+    if not new_content:
+        return jsonify({"error": "Failed to generate/modify content"}), 502
 
 
     return jsonify({'content': new_content})
 
+# LLM response cache statistics
+@app.route('/api/cache/stats', methods=['GET'])
+@token_required
+def cache_stats():
+    return jsonify(llm_cache.stats())
+
 # Generate Image
 @app.route('/api/generate_image', methods=['POST'])
 @token_required
 def generate_image():
     data = request.json
     img_prompt = data.get("prompt", "")
-    print("Received data:", data)
-    if not img_prompt:
-        return jsonify({"error": "Prompt is required"}), 400
-
-    seed = random.randint(0, 858993460)
-    native_request = {
-        "taskType": "TEXT_IMAGE",
-        "textToImageParams": {"text": img_prompt},
-        "imageGenerationConfig": {"seed": seed, "quality": "standard", "height": 400, "width": 800, "numberOfImages": 1},
-    }
+    log_payload("Received data", data)
+    if not isinstance(img_prompt, str) or not img_prompt.strip():
+        return jsonify({"error": "Prompt must be a non-empty string"}), 400
+
+    if wants_job(data, request.args):
+        return enqueue_job("generate_image", {"prompt": img_prompt}, data)
 
     try:
-        response = client.invoke_model(modelId=image_model_id, body=json.dumps(native_request))
-        model_response = json.loads(response["body"].read())
-        base64_image_data = model_response["images"][0]
+        return jsonify({"image_url": create_image(img_prompt)})
+    except bedrock.BedrockError as e:
+        return bedrock_error_response(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        output_dir = "static/uploads"
-        os.makedirs(output_dir, exist_ok=True)
-        image_path = os.path.join(output_dir, f"generated_image_{seed}.png")
-        with open(image_path, "wb") as file:
-            file.write(base64.b64decode(base64_image_data))
+def create_image(img_prompt):
+    [keys] = images.generate_and_store(client, s3, image_executor, image_model_id, AWS_BUCKET_NAME, [(img_prompt, 1)])
+    record_generated_images(keys)
+    return images.s3_url(REGION, AWS_BUCKET_NAME, keys[0])
+
+# Remember generated image sizes so published pages can declare them
+def record_generated_images(keys):
+    for key in keys:
+        digest = os.path.splitext(os.path.basename(key))[0]
+        db.save_image(digest, key, images.GENERATED_WIDTH, images.GENERATED_HEIGHT, [])
+
+# Turn {"prompts": [...]} or {"prompt": ..., "count": n} into (prompt, count) pairs
+def parse_image_requests(data):
+    if data.get("prompts"):
+        if not isinstance(data["prompts"], list):
+            return None, "prompts must be a list of strings"
+        requests = [(p, 1) for p in data["prompts"] if isinstance(p, str) and p.strip()]
+    elif data.get("prompt"):
+        if not isinstance(data["prompt"], str) or not data["prompt"].strip():
+            return None, "prompt must be a non-empty string"
+        requests = [(data["prompt"], int(data.get("count", 1)))]
+    else:
+        return None, "Prompt or prompts are required"
+    total = sum(count for _, count in requests)
+    if not requests or total < 1:
+        return None, "Prompt or prompts are required"
+    if total > MAX_IMAGES_PER_REQUEST:
+        return None, f"At most {MAX_IMAGES_PER_REQUEST} images per request"
+    return requests, None
+
+def create_images(requests):
+    keys = images.generate_and_store(client, s3, image_executor, image_model_id, AWS_BUCKET_NAME, requests)
+    record_generated_images([key for prompt_keys in keys for key in prompt_keys])
+    results = []
+    for (prompt, _), prompt_keys in zip(requests, keys):
+        results.append({"prompt": prompt, "image_urls": [images.s3_url(REGION, AWS_BUCKET_NAME, k) for k in prompt_keys]})
+    return {"images": results, "image_urls": [url for r in results for url in r["image_urls"]]}
+
+# Generate several images in one request
+@app.route('/api/generate_images', methods=['POST'])
+@token_required
+def generate_images():
+    data = request.json
+    try:
+        requests, error = parse_image_requests(data)
+    except (TypeError, ValueError):
+        requests, error = None, "count must be a number"
+    if error:
+        return jsonify({"error": error}), 400
 
-        s3_key = f"uploads/generated_image_{seed}.png"
-        s3.upload_file(image_path, AWS_BUCKET_NAME, s3_key, ExtraArgs={"ContentType": "image/png"})
-        s3_image_url = f"https://s3.{REGION}.amazonaws.com/{AWS_BUCKET_NAME}/{s3_key}"
+    if wants_job(data, request.args):
+        return enqueue_job("generate_images", {"requests": requests}, data)
 
-        return jsonify({"image_url": s3_image_url})
+    try:
+        return jsonify(create_images(requests))
+    except bedrock.BedrockError as e:
+        return bedrock_error_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -301,51 +685,52 @@ def generate_image():
 @app.route('/api/upload_image_to_s3', methods=['POST'])
 @token_required  # Add token authentication to match frontend
 def upload_image_to_s3():
-    print("L1")
     if 'image' not in request.files:
-        print("L2")
         return jsonify({'error': 'No image part'}), 400
     file = request.files['image']
     if file.filename == '':
-        print("L3")
         return jsonify({'error': 'No selected file'}), 400
 
-    if file:
-        print("L4")
-        filename = secure_filename(file.filename)
-        print("FILENAME",filename)
-        s3_key = f"uploads/{filename}"
-        img_upld = s3.upload_fileobj(file, AWS_BUCKET_NAME, s3_key, ExtraArgs={"ContentType": file.content_type})
-        print("IMAGE UPLOAD",img_upld)
-        image_url = f"https://s3.{REGION}.amazonaws.com/{AWS_BUCKET_NAME}/{s3_key}"
-        return jsonify({'image_url': image_url})
+    filename = secure_filename(file.filename)
+    try:
+        stored = images.store_upload(s3, AWS_BUCKET_NAME, file.stream, filename, file.content_type, image_executor)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    db.save_image(stored["digest"], stored["key"], stored["width"], stored["height"], stored["variants"])
+
+    url_for_key = lambda key: images.s3_url(REGION, AWS_BUCKET_NAME, key)
+    variants = [dict(v, url=url_for_key(v["key"])) for v in stored["variants"]]
+    return jsonify({
+        'image_url': url_for_key(stored["key"]),
+        'variants': variants,
+        'srcset': images.build_srcset(stored["variants"], url_for_key),
+    })
+
+def build_template_prompt(additional_prompt):
+    return prompts.registry.render("blog_template", additional_prompt=additional_prompt or "No additional requirements")
+
 # Generate Template
 @app.route('/api/generate_template', methods=['POST'])
 @token_required
 def generate_template():
     data = request.json
-    user_id = data.get("user_id")
-    topic_id = data.get("topic_id")
-    additional_prompt = data.get("additional_prompt", "")
-    print("Received data:", data)
-    if not user_id or not topic_id:
-        return jsonify({"error": "User ID and Topic ID are required"}), 400
+    log_payload("Received data", data)
+    try:
+        options = parse_template_request(data, request.args)
+    except RequestError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if options["job"]:
+        return enqueue_job("generate_template", options["job_payload"], data)
+
+    if options["stream"]:
+        return stream_claude_response(options["claude_prompt"], "html", use_cache=options["use_cache"])
 
-    prompt = """System: Generate a professional blog webpage template using only HTML and CSS.
-                Design requirements:
-                - Clean typography with proper spacing and line height for readability.
-                - Proper visual hierarchy to guide readers through the content.
-                - Should be a visually appealing webpage.
-                - Do not include any hyperlinks unless I explicitly mention them in the input. 
-                - Do NOT include any of the following unless I specifically mention them in my input:
-                    Hyperlinks (i.e., <a href="..."> tags)
-                    Text links
-                    Buttons that link to other pages (e.g., CTA buttons with links or navigation)
-                    This blog is meant to be self-contained. Use only plain text and images. No external references, links, or navigation elements unless requested.
-                """ + """ IMPORTANT: Your response should ONLY contain the complete HTML and CSS code i.e the response generated should start with <html> and end with </html>. Any explanations, descriptions, or additional information must be ignored included as HTML comments using the format: <!-- Additional information from the model: explanation here -->""" + f"\n\nHuman:{additional_prompt}\n\nAssistant:Webpage code"
-
-    filled_template = invoke_claude(prompt)
-    print("TEMP_OUTPUT", filled_template)
+    try:
+        filled_template = invoke_claude(options["claude_prompt"], use_cache=options["use_cache"])
+    except bedrock.BedrockError as e:
+        return bedrock_error_response(e)
+    log_payload("TEMP_OUTPUT", filled_template)
     return jsonify({"html": filled_template})
 
 # Save Webpage (store in database)
@@ -356,23 +741,22 @@ def save_webpage():
     user_id = data.get("user_id")
     topic_id = data.get("topic_id")
     html_content = data.get("html_content")
-    print("Received data:", data)
-    if not all([user_id, topic_id, html_content]):
+    patch = data.get("patch")
+    base_version = data.get("base_version")
+    log_payload("Received data", data)
+    if not all([user_id, topic_id]) or (not html_content and patch is None):
         return jsonify({"error": "Missing required fields"}), 400
+    if patch is not None and base_version is None:
+        return jsonify({"error": "base_version is required with a patch"}), 400
 
-    conn = sqlite3.connect('blog_content.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM webpages WHERE user_id = ? AND topic_id = ?", (user_id, topic_id))
-    existing_id = cursor.fetchone()
-
-    if existing_id:
-        cursor.execute("UPDATE webpages SET html_content = ? WHERE id = ?", (html_content, existing_id[0]))
-    else:
-        cursor.execute("INSERT INTO webpages (user_id, topic_id, html_content) VALUES (?, ?, ?)", (user_id, topic_id, html_content))
-    conn.commit()
-    conn.close()
+    try:
+        version = pages.save(user_id, topic_id, html_content=html_content, patch=patch, base_version=base_version)
+    except pages.VersionConflict as e:
+        return jsonify({"error": str(e), "version": e.current_version}), 409
+    except (pages.InvalidPatch, ValueError) as e:
+        return jsonify({"error": f"Invalid patch: {e}"}), 400
 
-    return jsonify({"success": True})
+    return jsonify({"success": True, "version": version})
 
 # Get Webpage Content
 @app.route('/api/get_webpage', methods=['GET'])
@@ -382,20 +766,53 @@ def get_webpage():
     # print("REQUEST FOR WEBPAGE ",data)
     user_id = request.args.get('user_id')
     topic_id = request.args.get('topic_id')
-    print(f"USERID = {user_id} AND TOPICID  = {topic_id}")
+    logger.debug("USERID = %s AND TOPICID = %s", user_id, topic_id)
     if not user_id or not topic_id:
         return jsonify({"error": "User ID and Topic ID are required"}), 400
 
-    conn = sqlite3.connect('blog_content.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT html_content FROM webpages WHERE user_id = ? AND topic_id = ?", (user_id, topic_id))
-    result = cursor.fetchone()
-    print("DB_CONTENT_HTML",result)
-    conn.close()
-
-    if result and result[0]:
-        return jsonify({"html_content": result[0]})
-    return jsonify({"error": "No webpage found"}), 404
+    if request.args.get('version'):
+        try:
+            html_content, version = pages.load_html(user_id, topic_id, request.args.get('version'))
+        except ValueError:
+            return jsonify({"error": "Invalid version"}), 400
+        log_payload("DB_CONTENT_HTML", html_content)
+        if html_content:
+            return jsonify({"html_content": html_content, "version": version})
+        return jsonify({"error": "No webpage found"}), 404
+
+    # Answer revalidation from the stored hash without loading the page
+    version, digest = pages.current_hash(user_id, topic_id)
+    if version is None:
+        return jsonify({"error": "No webpage found"}), 404
+    if digest and request.if_none_match.contains_weak(pages.page_etag(version, digest)):
+        return webpage_response(b"", pages.page_etag(version, digest), status=304)
+
+    page = pages.compressed_page(user_id, topic_id)
+    if not page:
+        return jsonify({"error": "No webpage found"}), 404
+    etag = pages.page_etag(page["version"], page["content_hash"])
+    if "gzip" in request.accept_encodings:
+        return webpage_response(page["body_gz"], etag, content_encoding="gzip")
+    return webpage_response(gzip.decompress(page["body_gz"]), etag)
+
+def webpage_response(body, etag, status=200, content_encoding=None):
+    response = Response(body, status=status, mimetype="application/json")
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("Accept-Encoding")
+    if content_encoding:
+        response.headers["Content-Encoding"] = content_encoding
+    return response
+
+# Saved versions of a webpage
+@app.route('/api/webpage_history', methods=['GET'])
+@token_required
+def webpage_history():
+    user_id = request.args.get('user_id')
+    topic_id = request.args.get('topic_id')
+    if not user_id or not topic_id:
+        return jsonify({"error": "User ID and Topic ID are required"}), 400
+    return jsonify({"versions": pages.history(user_id, topic_id)})
 
 # Upload to S3 (for hosting only)
 @app.route('/api/upload_to_s3', methods=['POST'])
@@ -405,17 +822,159 @@ def upload_to_s3():
     user_id = data.get("user_id")
     topic_id = data.get("topic_id")
     html_content = data.get("html_content")
-    print("Received data:", data)
+    log_payload("Received data", data)
     if not all([user_id, topic_id, html_content]):
         return jsonify({"error": "Missing required fields"}), 400
 
-    s3_key = f"webpages/{user_id}_{topic_id}.html"
     try:
-        s3.put_object(Bucket=AWS_BUCKET_NAME, Body=html_content, Key=s3_key, ContentType="text/html")
-        s3_url = f"https://s3.{REGION}.amazonaws.com/{AWS_BUCKET_NAME}/{s3_key}"
-        return jsonify({"s3_url": s3_url})
+        results = publish_pages(user_id, {topic_id: html_content}, force=bool(data.get("force")))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    result = results[str(topic_id)]
+    if result["status"] == "failed":
+        return jsonify({"error": result["error"]}), 500
+    return jsonify({"s3_url": result["url"], "status": result["status"]})
+
+# Size and WebP srcset for an image we stored, from the URL used in a page
+def published_image_info(src):
+    digest = html_pipeline.upload_digest(src)
+    record = db.get_image(digest) if digest else None
+    if not record:
+        return None
+    url_for_key = lambda key: images.s3_url(REGION, AWS_BUCKET_NAME, key)
+    srcset = images.build_srcset(record["variants"], url_for_key).get("webp")
+    if srcset and record["width"]:
+        srcset += f", {src} {record['width']}w"
+    return {"width": record["width"], "height": record["height"], "srcset": srcset}
+
+# Pages are minified and their images given dimensions and srcsets when published
+# (PUBLISH_TRANSFORM=0 uploads the saved HTML unchanged)
+publish_transform = None
+if os.environ.get("PUBLISH_TRANSFORM", "1") != "0":
+    publish_transform = html_pipeline.HtmlPipeline(image_info=published_image_info)
+
+def publish_pages(user_id, pages_by_topic, force=False):
+    results = publish.publish_pages(
+        s3, AWS_BUCKET_NAME, publish_executor, user_id, pages_by_topic, encoding=PUBLISH_ENCODING, force=force,
+        transform=publish_transform,
+    )
+    for result in results.values():
+        result["url"] = images.s3_url(REGION, AWS_BUCKET_NAME, result["key"])
+    return results
+
+# Saved pages for a user's topics (all topics when topic_ids is empty)
+def load_saved_pages(user_id, topic_ids=None):
+    if not topic_ids:
+        topic_ids = [topic["id"] for topic in db.list_topics(user_id)]
+    pages_by_topic = {}
+    for topic_id in topic_ids:
+        html_content, _ = pages.load_html(user_id, topic_id)
+        if html_content:
+            pages_by_topic[topic_id] = html_content
+    return pages_by_topic
+
+# Publish saved pages to S3 in one call; unchanged pages are skipped
+@app.route('/api/publish', methods=['POST'])
+@token_required
+def publish_saved_pages():
+    data = request.json
+    user_id = data.get("user_id")
+    topic_ids = data.get("topic_ids") or []
+    if not user_id:
+        return jsonify({"error": "User ID is required"}), 400
+    if not (isinstance(topic_ids, list) and all(isinstance(i, int) for i in topic_ids)):
+        return jsonify({"error": "topic_ids must be a list of integers"}), 400
+
+    if wants_job(data, request.args):
+        return enqueue_job("publish", {"user_id": user_id, "topic_ids": topic_ids, "force": bool(data.get("force"))}, data)
+
+    try:
+        return jsonify(publish_job({"user_id": user_id, "topic_ids": topic_ids, "force": bool(data.get("force"))}))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Background job handlers, run by the worker pool outside the request context
+def generate_job(payload):
+    plan = None
+    if payload.get("sections"):
+        plan = plan_sections(payload["content"], payload["prompt"], payload.get("section_ids"))
+    if plan:
+        return generate_by_sections(plan, payload["prompt"], use_cache=not payload.get("no_cache"))
+    claude_prompt = build_generate_prompt(payload["content"], payload["prompt"])
+    new_content = invoke_claude(claude_prompt, use_cache=not payload.get("no_cache"))
+    if not new_content:
+        raise RuntimeError("Failed to generate/modify content")
+    return {"content": new_content}
+
+def generate_template_job(payload):
+    prompt = build_template_prompt(payload["additional_prompt"])
+    return {"html": invoke_claude(prompt, use_cache=not payload.get("no_cache"))}
+
+def generate_image_job(payload):
+    return {"image_url": create_image(payload["prompt"])}
+
+def generate_images_job(payload):
+    return create_images([(prompt, count) for prompt, count in payload["requests"]])
+
+def publish_job(payload):
+    pages_by_topic = load_saved_pages(payload["user_id"], payload["topic_ids"])
+    results = publish_pages(payload["user_id"], pages_by_topic, force=payload.get("force", False))
+    return {
+        "pages": results,
+        "manifest_url": images.s3_url(REGION, AWS_BUCKET_NAME, publish.manifest_key(payload["user_id"])),
+    }
+
+job_handlers = {
+    "generate": generate_job,
+    "generate_template": generate_template_job,
+    "generate_image": generate_image_job,
+    "generate_images": generate_images_job,
+    "publish": publish_job,
+}
+job_queue = JobQueue(
+    job_handlers,
+    concurrency=int(os.environ.get("JOB_CONCURRENCY", "4")),
+    max_pending=int(os.environ.get("JOB_MAX_PENDING", "100")),
+)
+job_queue.start()
+
+def get_user_job(job_id):
+    job = db.get_job(job_id)
+    if not job or job["user_id"] != request.user_id:
+        return None
+    return job
+
+# Job status
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_job_status(job_id):
+    job = get_user_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(public_job(job))
+
+# Job status as server-sent events, until the job finishes
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+@token_required
+def stream_job_status(job_id):
+    job = get_user_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    def generate():
+        last_status = None
+        while True:
+            current = db.get_job(job_id)
+            if current["status"] != last_status:
+                last_status = current["status"]
+                yield sse_event(public_job(current), event=last_status)
+            if last_status in ("done", "failed"):
+                return
+            time.sleep(0.5)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+
+# Development server; production runs through serve.py
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=os.environ.get("FLASK_DEBUG") == "1", threaded=True)
\ No newline at end of file
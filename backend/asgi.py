@@ -0,0 +1,301 @@
+"""ASGI entry point: the generation routes as async handlers, everything else served
+by the Flask app on a thread pool.
+
+    uvicorn asgi:app --workers 2        (or: python serve.py --mode asgi)
+
+A generation in flight is an awaiting coroutine rather than a blocked thread, so one
+process holds as many concurrent model calls as the Bedrock quota allows. Bedrock
+calls use aiobotocore when it is installed and are offloaded to a thread pool
+otherwise. Routes, request bodies and responses match the Flask app.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+
+import jwt
+from botocore.config import Config
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as wsgi
+import bedrock
+import db
+import metrics
+from jobs import public_job
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:  # a2wsgi is optional; Starlette's adapter runs Flask on anyio's thread pool
+    from starlette.middleware.wsgi import WSGIMiddleware as StarletteWSGIMiddleware
+    WSGIMiddleware = lambda wsgi_app, workers: StarletteWSGIMiddleware(wsgi_app)
+
+try:
+    from aiobotocore.session import get_session
+except ImportError:  # aiobotocore is optional; without it Bedrock calls run on a thread pool
+    get_session = None
+
+# Connections kept open to Bedrock; bounds the in-flight model calls per process
+ASYNC_MAX_CONNECTIONS = int(os.environ.get("ASYNC_MAX_CONNECTIONS", "512"))
+# Threads for blocking Bedrock calls when aiobotocore is unavailable
+ASYNC_OFFLOAD_WORKERS = int(os.environ.get("ASYNC_OFFLOAD_WORKERS", "64"))
+# Threads serving the Flask routes
+WSGI_THREADS = int(os.environ.get("WSGI_THREADS", "32"))
+
+client = None
+
+
+@asynccontextmanager
+async def lifespan(_):
+    global client
+    async with AsyncExitStack() as stack:
+        if get_session is not None and os.environ.get("BLOG_FAKE_AWS") != "1":
+            config = Config(connect_timeout=10, read_timeout=600, retries={"total_max_attempts": 1},
+                            max_pool_connections=ASYNC_MAX_CONNECTIONS)
+            raw = await stack.enter_async_context(
+                get_session().create_client("bedrock-runtime", region_name=wsgi.REGION, config=config)
+            )
+            raw = metrics.instrument_client(raw, "bedrock")
+        else:
+            executor = ThreadPoolExecutor(max_workers=ASYNC_OFFLOAD_WORKERS)
+            stack.callback(executor.shutdown, wait=False)
+            raw = bedrock.ThreadOffloadClient(wsgi.client.client, executor)
+        client = bedrock.AsyncAdaptiveClient(raw, wsgi.client)
+        yield
+
+
+def authenticate(request):
+    token = request.headers.get("Authorization")
+    if not token or not token.startswith("Bearer "):
+        return None, JSONResponse({"error": "Token is missing"}, 401)
+    try:
+        payload = jwt.decode(token.split(" ")[1], wsgi.SECRET_KEY, algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        return None, JSONResponse({"error": "Invalid token"}, 401)
+    return payload["user_id"], None
+
+
+# JSON object body of a request, or the 400 response to send instead
+async def read_json(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return None, JSONResponse({"error": "Request body must be valid JSON"}, 400)
+    if not isinstance(data, dict):
+        return None, JSONResponse({"error": "Request body must be a JSON object"}, 400)
+    return data, None
+
+
+def bedrock_error_response(error):
+    body, status, headers = wsgi.bedrock_error(error)
+    return JSONResponse(body, status, headers=headers)
+
+
+def event_stream(events):
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events, media_type="text/event-stream", headers=headers)
+
+
+async def enqueue_job(user_id, kind, payload, data):
+    body, status = await run_in_threadpool(wsgi.submit_job, user_id, kind, payload, data)
+    return JSONResponse(body, status)
+
+
+# Awaiting versions of app.invoke_claude / app.invoke_claude_stream, sharing its cache
+async def invoke_claude(prompt, use_cache=True):
+    cache_key = wsgi.claude_cache_key(prompt)
+    if use_cache:
+        cached = await run_in_threadpool(wsgi.llm_cache.get, cache_key)
+        if cached is not None:
+            return cached
+    reply = wsgi.ClaudeReply(prompt)
+    for kwargs in reply.requests():
+        reply.add_response(await client.converse(**kwargs))
+    await run_in_threadpool(wsgi.llm_cache.set, cache_key, reply.text)
+    return reply.text
+
+
+async def invoke_claude_stream(prompt, use_cache=True):
+    cache_key = wsgi.claude_cache_key(prompt)
+    if use_cache:
+        cached = await run_in_threadpool(wsgi.llm_cache.get, cache_key)
+        if cached is not None:
+            yield cached
+            return
+    reply = wsgi.ClaudeReply(prompt)
+    for kwargs in reply.requests():
+        response = await client.converse_stream(**kwargs)
+        async for event in response["stream"]:
+            text = reply.add_event(event)
+            if text:
+                yield text
+    text = reply.flush()
+    if text:
+        yield text
+    await run_in_threadpool(wsgi.llm_cache.set, cache_key, reply.text)
+
+
+async def stream_claude_events(prompt, result_key, use_cache=True):
+    parts = []
+    try:
+        async for text in invoke_claude_stream(prompt, use_cache=use_cache):
+            parts.append(text)
+            yield wsgi.sse_event({"delta": text})
+    except Exception as e:
+        yield wsgi.error_event(e)
+        return
+    yield wsgi.sse_event({result_key: "".join(parts)}, event="done")
+
+
+# Edited sections as (section_id, text), in the order they finish
+async def iter_section_edits(plan, prompt, use_cache=True):
+    async def edit(section_id, section_prompt):
+        return section_id, await invoke_claude(section_prompt, use_cache=use_cache)
+
+    tasks = [asyncio.ensure_future(edit(*item)) for item in wsgi.section_prompts(plan, prompt)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def generate_by_sections(plan, prompt, use_cache=True):
+    replacements = {section_id: text async for section_id, text in iter_section_edits(plan, prompt, use_cache)}
+    return {"content": wsgi.stitch_sections(plan, replacements), "sections": wsgi.section_summary(plan)}
+
+
+async def stream_section_events(plan, prompt, use_cache=True):
+    yield wsgi.sse_event({"sections": wsgi.section_summary(plan)}, event="plan")
+    replacements = {}
+    try:
+        async for section_id, text in iter_section_edits(plan, prompt, use_cache):
+            replacements[section_id] = text
+            yield wsgi.sse_event({"id": section_id, "content": text}, event="section")
+    except Exception as e:
+        yield wsgi.error_event(e)
+        return
+    yield wsgi.sse_event({"content": wsgi.stitch_sections(plan, replacements)}, event="done")
+
+
+# Generate/Modify Blog Content
+async def generate_or_modify_blog(request):
+    user_id, error = authenticate(request)
+    if error:
+        return error
+    data, error = await read_json(request)
+    if error:
+        return error
+    wsgi.log_payload("Received data", data)
+    try:
+        options = wsgi.parse_generate_request(data, request.query_params)
+    except wsgi.RequestError as e:
+        return JSONResponse({"error": str(e)}, 400)
+
+    if options["job"]:
+        return await enqueue_job(user_id, "generate", options["job_payload"], data)
+
+    prompt, use_cache = options["prompt"], options["use_cache"]
+    if options["plan"]:
+        if options["stream"]:
+            return event_stream(stream_section_events(options["plan"], prompt, use_cache))
+        try:
+            return JSONResponse(await generate_by_sections(options["plan"], prompt, use_cache))
+        except bedrock.BedrockError as e:
+            return bedrock_error_response(e)
+
+    if options["stream"]:
+        return event_stream(stream_claude_events(options["claude_prompt"], "content", use_cache))
+    try:
+        new_content = await invoke_claude(options["claude_prompt"], use_cache=use_cache)
+    except bedrock.BedrockError as e:
+        return bedrock_error_response(e)
+    wsgi.log_payload("Claude response", new_content)
+    if not new_content:
+        return JSONResponse({"error": "Failed to generate/modify content"}, 502)
+    return JSONResponse({"content": new_content})
+
+
+# Generate Template
+async def generate_template(request):
+    user_id, error = authenticate(request)
+    if error:
+        return error
+    data, error = await read_json(request)
+    if error:
+        return error
+    wsgi.log_payload("Received data", data)
+    try:
+        options = wsgi.parse_template_request(data, request.query_params)
+    except wsgi.RequestError as e:
+        return JSONResponse({"error": str(e)}, 400)
+
+    if options["job"]:
+        return await enqueue_job(user_id, "generate_template", options["job_payload"], data)
+
+    if options["stream"]:
+        return event_stream(stream_claude_events(options["claude_prompt"], "html", options["use_cache"]))
+    try:
+        filled_template = await invoke_claude(options["claude_prompt"], use_cache=options["use_cache"])
+    except bedrock.BedrockError as e:
+        return bedrock_error_response(e)
+    wsgi.log_payload("TEMP_OUTPUT", filled_template)
+    return JSONResponse({"html": filled_template})
+
+
+# Job status as server-sent events; waiting here costs no thread between polls
+async def stream_job_status(request):
+    user_id, error = authenticate(request)
+    if error:
+        return error
+    job_id = request.path_params["job_id"]
+    job = await run_in_threadpool(db.get_job, job_id)
+    if not job or job["user_id"] != user_id:
+        return JSONResponse({"error": "Job not found"}, 404)
+
+    async def events():
+        last_status = None
+        while True:
+            current = await run_in_threadpool(db.get_job, job_id)
+            if current["status"] != last_status:
+                last_status = current["status"]
+                yield wsgi.sse_event(public_job(current), event=last_status)
+            if last_status in ("done", "failed"):
+                return
+            await asyncio.sleep(0.5)
+
+    return event_stream(events())
+
+
+# Record request latency like the Flask after_request hook does
+def timed(path, handler):
+    async def endpoint(request):
+        start = time.perf_counter()
+        response = await handler(request)
+        metrics.request_duration.observe(
+            time.perf_counter() - start, route=path, method=request.method, status=response.status_code
+        )
+        if response.status_code >= 500:
+            metrics.request_errors.inc(route=path, method=request.method)
+        return response
+
+    return endpoint
+
+
+app = Starlette(
+    routes=[
+        Route("/api/generate", timed("/api/generate", generate_or_modify_blog), methods=["POST"]),
+        Route("/api/generate_template", timed("/api/generate_template", generate_template), methods=["POST"]),
+        Route("/api/jobs/{job_id}/events", timed("/api/jobs/<job_id>/events", stream_job_status), methods=["GET"]),
+        Mount("/", WSGIMiddleware(wsgi.app, workers=WSGI_THREADS)),
+    ],
+    # Same policy as flask_cors.CORS(app); preflight requests are answered here for every route
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+    lifespan=lifespan,
+)
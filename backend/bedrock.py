@@ -0,0 +1,407 @@
+import asyncio
+import hashlib
+import inspect
+import io
+import json
+import random
+import threading
+import time
+from concurrent.futures import Future
+from functools import partial
+
+from botocore.exceptions import BotoCoreError, ClientError, ConnectionError as BotoConnectionError, ReadTimeoutError
+
+import metrics
+from metrics import logger
+
+
+class BedrockError(Exception):
+    status = 502
+
+
+class ThrottledError(BedrockError):
+    status = 429
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UnavailableError(BedrockError):
+    status = 503
+
+
+class InvalidRequestError(BedrockError):
+    status = 400
+
+
+# The model did not answer in time. Not retried: a call that ran into the read
+# timeout once would likely do so again, multiplying the time the caller waits.
+class TimedOutError(BedrockError):
+    status = 504
+
+
+THROTTLE_CODES = {"ThrottlingException", "TooManyRequestsException"}
+UNAVAILABLE_CODES = {"ServiceUnavailableException", "ModelNotReadyException", "InternalServerException"}
+TIMEOUT_CODES = {"ModelTimeoutException"}
+INVALID_CODES = {"ValidationException"}
+
+
+# Map a botocore exception to one of the errors above
+def classify_error(error):
+    if isinstance(error, BedrockError):
+        return error
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code", "")
+        message = error.response.get("Error", {}).get("Message", str(error))
+        if code in THROTTLE_CODES:
+            return ThrottledError(f"Bedrock is throttling requests: {message}")
+        if code in UNAVAILABLE_CODES:
+            return UnavailableError(f"Bedrock is unavailable: {message}")
+        if code in TIMEOUT_CODES:
+            return TimedOutError(f"Bedrock timed out: {message}")
+        if code in INVALID_CODES:
+            return InvalidRequestError(f"Bedrock rejected the request: {message}")
+        return BedrockError(f"Bedrock call failed: {code} {message}")
+    if isinstance(error, ReadTimeoutError):
+        return TimedOutError(f"Bedrock did not respond in time: {error}")
+    if isinstance(error, BotoConnectionError):
+        return UnavailableError(f"Could not reach Bedrock: {error}")
+    if isinstance(error, BotoCoreError):
+        return BedrockError(f"Bedrock call failed: {error}")
+    return error
+
+
+# Token bucket refilled continuously at `per_minute`; `scale` lowers the refill rate
+# while Bedrock is throttling us and recovers it as calls succeed again
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.scale = 1.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        rate = self.capacity * self.scale / 60.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    # Seconds until `amount` is available, reserving it when that is 0
+    def try_take(self, amount):
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / (self.capacity * self.scale / 60.0)
+
+    def give_back(self, amount):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def slow_down(self, factor=0.5, floor=0.1):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.scale = max(floor, self.scale * factor)
+
+    def speed_up(self, step=0.05):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.scale = min(1.0, self.scale + step)
+
+
+# Request and token quotas for one model. tpm=None means tokens are not limited
+# (image models are billed per image).
+class ModelLimiter:
+    def __init__(self, rpm, tpm=None):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    # Seconds to wait before trying again, 0 once a request and its tokens are reserved
+    def reserve(self, tokens, deadline):
+        wait = self.requests.try_take(1)
+        if wait == 0 and self.tokens is not None:
+            wait = self.tokens.try_take(tokens)
+            if wait:
+                self.requests.give_back(1)
+        if wait and time.monotonic() + wait > deadline:
+            raise ThrottledError("Bedrock request quota exhausted; try again shortly", retry_after=int(wait) + 1)
+        return min(wait, 1.0)
+
+    def acquire(self, tokens, max_wait):
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.reserve(tokens, deadline)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens, max_wait):
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.reserve(tokens, deadline)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def settle(self, reserved, used):
+        if self.tokens is not None and used < reserved:
+            self.tokens.give_back(reserved - used)
+
+    def throttled(self):
+        self.requests.slow_down()
+        if self.tokens is not None:
+            self.tokens.slow_down()
+
+    def succeeded(self):
+        self.requests.speed_up()
+        if self.tokens is not None:
+            self.tokens.speed_up()
+
+
+# Rough token count for a converse request: the input text plus the maxTokens reservation
+def estimate_tokens(kwargs):
+    messages = kwargs.get("messages") or []
+    system = kwargs.get("system") or []
+    chars = sum(len(block.get("text", "")) for message in messages for block in message.get("content", []))
+    chars += sum(len(block.get("text", "")) for block in system)
+    return chars // 4 + (kwargs.get("inferenceConfig") or {}).get("maxTokens", 0)
+
+
+# What coalesced followers get of a converse response: the same output without
+# "usage", since the tokens were billed once, to the leader, and are counted there
+def follower_response(response):
+    return {key: value for key, value in response.items() if key != "usage"}
+
+
+def request_key(operation, kwargs):
+    return hashlib.sha256(f"{operation}\0{json.dumps(kwargs, sort_keys=True, default=str)}".encode("utf-8")).hexdigest()
+
+
+# Wraps a bedrock-runtime client. Every call waits for the model's quota, is retried
+# with full-jitter exponential backoff while Bedrock throttles, and raises one of the
+# typed errors above. Concurrent identical converse/invoke_model calls share one request.
+class AdaptiveClient:
+    def __init__(self, client, limits=None, default_limit=(100, 200000), max_retries=4, base_delay=0.5,
+                 max_delay=20.0, max_wait=30.0):
+        self.client = client
+        self.meta = client.meta
+        self.limits = dict(limits or {})
+        self.default_limit = default_limit
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self._limiters = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, model_id):
+        with self._lock:
+            limiter = self._limiters.get(model_id)
+            if limiter is None:
+                rpm, tpm = self.limits.get(model_id, self.default_limit)
+                limiter = self._limiters[model_id] = ModelLimiter(rpm, tpm)
+            return limiter
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _call(self, operation, kwargs, reserved):
+        model_id = kwargs.get("modelId", "unknown")
+        limiter = self.limiter(model_id)
+        for attempt in range(self.max_retries + 1):
+            with metrics.bedrock_limiter_wait.time(model=model_id):
+                limiter.acquire(reserved, self.max_wait)
+            try:
+                response = getattr(self.client, operation)(**kwargs)
+            except Exception as e:
+                time.sleep(self.retry_delay(operation, model_id, limiter, reserved, e, attempt))
+                continue
+            limiter.succeeded()
+            return response, limiter
+
+    # Backoff before the next attempt after a failed call; raises the typed error
+    # when the failure is not retryable or the retries are used up. Only throttling,
+    # connection errors and fast 5xx failures are retried, never timeouts.
+    def retry_delay(self, operation, model_id, limiter, reserved, e, attempt):
+        limiter.settle(reserved, 0)
+        error = classify_error(e)
+        if error is e:
+            raise e
+        if not isinstance(error, (ThrottledError, UnavailableError)) or attempt == self.max_retries:
+            raise error from e
+        if isinstance(error, ThrottledError):
+            limiter.throttled()
+            metrics.bedrock_throttles.inc(model=model_id)
+        delay = self.backoff(attempt)
+        logger.info("Bedrock %s failed (%s); retrying in %.2fs", operation, error, delay)
+        return delay
+
+    # Run fn once for all concurrent callers with the same key. Callers other than
+    # the first get follower(result) when given.
+    def _coalesce(self, key, fn, follower=None):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            metrics.bedrock_coalesced.inc()
+            result = future.result()
+            return follower(result) if follower else result
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def converse(self, **kwargs):
+        def call():
+            reserved = estimate_tokens(kwargs)
+            response, limiter = self._call("converse", kwargs, reserved)
+            limiter.settle(reserved, (response.get("usage") or {}).get("totalTokens", reserved))
+            return response
+
+        return self._coalesce(request_key("converse", kwargs), call, follower_response)
+
+    def converse_stream(self, **kwargs):
+        reserved = estimate_tokens(kwargs)
+        response, limiter = self._call("converse_stream", kwargs, reserved)
+
+        # Return unused reserved tokens once the stream reports its usage
+        def events():
+            try:
+                for event in response["stream"]:
+                    if "metadata" in event:
+                        usage = event["metadata"].get("usage") or {}
+                        limiter.settle(reserved, usage.get("inputTokens", 0) + usage.get("outputTokens", 0))
+                    yield event
+            except (BotoCoreError, ClientError) as e:
+                raise classify_error(e) from e
+
+        return dict(response, stream=events())
+
+    def invoke_model(self, **kwargs):
+        def call():
+            response, _ = self._call("invoke_model", kwargs, 0)
+            return dict(response, body=response["body"].read())
+
+        # Each caller gets its own readable body
+        response = self._coalesce(request_key("invoke_model", kwargs), call)
+        return dict(response, body=io.BytesIO(response["body"]))
+
+
+async def read_body(body):
+    data = body.read()
+    return await data if inspect.isawaitable(data) else data
+
+
+# Async face for a blocking bedrock-runtime client, running its calls on an executor.
+# Used when aiobotocore is not installed, and for the fake clients.
+class ThreadOffloadClient:
+    def __init__(self, client, executor):
+        self.client = client
+        self.executor = executor
+
+    async def _run(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(fn, *args, **kwargs))
+
+    async def converse(self, **kwargs):
+        return await self._run(self.client.converse, **kwargs)
+
+    async def invoke_model(self, **kwargs):
+        return await self._run(self.client.invoke_model, **kwargs)
+
+    async def converse_stream(self, **kwargs):
+        response = await self._run(self.client.converse_stream, **kwargs)
+        stream = iter(response["stream"])
+
+        async def events():
+            while True:
+                event = await self._run(next, stream, None)
+                if event is None:
+                    return
+                yield event
+
+        return dict(response, stream=events())
+
+
+# AdaptiveClient for asyncio code. `client` is an aiobotocore bedrock-runtime client
+# or a ThreadOffloadClient; quotas, retry settings and limiter state are shared with
+# the blocking AdaptiveClient `shared`, since both draw on the same account quota.
+class AsyncAdaptiveClient:
+    def __init__(self, client, shared):
+        self.client = client
+        self.shared = shared
+        self._inflight = {}
+
+    async def _call(self, operation, kwargs, reserved):
+        model_id = kwargs.get("modelId", "unknown")
+        limiter = self.shared.limiter(model_id)
+        for attempt in range(self.shared.max_retries + 1):
+            with metrics.bedrock_limiter_wait.time(model=model_id):
+                await limiter.acquire_async(reserved, self.shared.max_wait)
+            try:
+                response = await getattr(self.client, operation)(**kwargs)
+            except Exception as e:
+                await asyncio.sleep(self.shared.retry_delay(operation, model_id, limiter, reserved, e, attempt))
+                continue
+            limiter.succeeded()
+            return response, limiter
+
+    # Await one call for all concurrent callers with the same key
+    async def _coalesce(self, key, fn, follower=None):
+        future = self._inflight.get(key)
+        if future is not None:
+            metrics.bedrock_coalesced.inc()
+            result = await asyncio.shield(future)
+            return follower(result) if follower else result
+        future = self._inflight[key] = asyncio.ensure_future(fn())
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                self._inflight.pop(key, None)
+            else:
+                future.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+    async def converse(self, **kwargs):
+        async def call():
+            reserved = estimate_tokens(kwargs)
+            response, limiter = await self._call("converse", kwargs, reserved)
+            limiter.settle(reserved, (response.get("usage") or {}).get("totalTokens", reserved))
+            return response
+
+        return await self._coalesce(request_key("converse", kwargs), call, follower_response)
+
+    async def converse_stream(self, **kwargs):
+        reserved = estimate_tokens(kwargs)
+        response, limiter = await self._call("converse_stream", kwargs, reserved)
+
+        async def events():
+            try:
+                async for event in response["stream"]:
+                    if "metadata" in event:
+                        usage = event["metadata"].get("usage") or {}
+                        limiter.settle(reserved, usage.get("inputTokens", 0) + usage.get("outputTokens", 0))
+                    yield event
+            except (BotoCoreError, ClientError) as e:
+                raise classify_error(e) from e
+
+        return dict(response, stream=events())
+
+    async def invoke_model(self, **kwargs):
+        async def call():
+            response, _ = await self._call("invoke_model", kwargs, 0)
+            return dict(response, body=await read_body(response["body"]))
+
+        response = await self._coalesce(request_key("invoke_model", kwargs), call)
+        return dict(response, body=io.BytesIO(response["body"]))
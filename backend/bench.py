@@ -0,0 +1,228 @@
+"""Load test for the API hot paths against in-process fake Bedrock and S3 clients.
+
+    python bench.py --concurrency 1,8,32 --duration 10
+    python bench.py --mix generate=1 --first-token-latency 2 --json
+
+Each worker thread drives the Flask app through its own test client, so the numbers
+cover routing, auth, SQLite and the generation/upload code paths without network I/O.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import warnings
+
+DEFAULT_MIX = "generate=0.15,save_webpage=0.3,get_webpage=0.45,upload_image=0.1"
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def sample_page(topic_id, paragraphs):
+    body = "".join(
+        f"<section><h2>Section {i}</h2><p>{'Lorem ipsum dolor sit amet. ' * 40}</p></section>" for i in range(paragraphs)
+    )
+    return f"<!DOCTYPE html><html><head><title>Topic {topic_id}</title></head><body>{body}</body></html>"
+
+
+# Per-worker state: a test client and a page this worker owns, so saves don't conflict
+class Worker:
+    def __init__(self, app_module, headers, user_id, topic_id, page_paragraphs):
+        self.app = app_module
+        self.client = app_module.app.test_client()
+        self.headers = headers
+        self.user_id = user_id
+        self.topic_id = topic_id
+        self.html = sample_page(topic_id, page_paragraphs)
+        self.version = None
+        self.etag = None
+        self.rng = random.Random(topic_id)
+
+    def generate(self):
+        # A share of requests repeat an earlier prompt, as retries and double clicks do
+        prompt = f"Rewrite this paragraph #{self.rng.randrange(50)} in a friendlier tone"
+        content = "<p>" + "Lorem ipsum dolor sit amet. " * 30 + "</p>"
+        return self.client.post(
+            "/api/generate",
+            json={"user_id": self.user_id, "topic_id": self.topic_id, "content": content, "prompt": prompt},
+            headers=self.headers,
+        )
+
+    def save_webpage(self):
+        new_html = self.html.replace("Lorem", f"Edit{self.rng.randrange(1000)}", 1)
+        if self.version is None:
+            body = {"user_id": self.user_id, "topic_id": self.topic_id, "html_content": new_html}
+        else:
+            patch = self.app.pages.diff_html(self.html, new_html)
+            body = {"user_id": self.user_id, "topic_id": self.topic_id, "patch": patch, "base_version": self.version}
+        response = self.client.post("/api/save_webpage", json=body, headers=self.headers)
+        if response.status_code == 200:
+            self.html = new_html
+            self.version = response.get_json()["version"]
+        return response
+
+    def get_webpage(self):
+        headers = dict(self.headers, **{"Accept-Encoding": "gzip"})
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        response = self.client.get(
+            f"/api/get_webpage?user_id={self.user_id}&topic_id={self.topic_id}", headers=headers
+        )
+        self.etag = response.headers.get("ETag") or self.etag
+        return response
+
+    def upload_image(self):
+        from fakes import make_png
+
+        data = make_png(width=400, height=200, seed=self.rng.randrange(20))
+        return self.client.post(
+            "/api/upload_image_to_s3",
+            data={"image": (io.BytesIO(data), "photo.png")},
+            headers=self.headers,
+            content_type="multipart/form-data",
+        )
+
+
+def run_level(app_module, workers, mix, duration):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    results = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def loop(worker):
+        rng = random.Random(worker.topic_id)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = getattr(worker, name)()
+                response.get_data()
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            elapsed = time.perf_counter() - start
+            with lock:
+                results[name].append(elapsed)
+                if failed:
+                    errors[name] += 1
+
+    threads = [threading.Thread(target=loop, args=(worker,)) for worker in workers]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report = {"concurrency": len(workers), "seconds": elapsed, "operations": {}}
+    total = 0
+    for name in names:
+        latencies = results[name]
+        total += len(latencies)
+        report["operations"][name] = {
+            "requests": len(latencies),
+            "errors": errors[name],
+            "throughput": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+        }
+    report["throughput"] = total / elapsed
+    return report
+
+
+def print_report(report):
+    memory = f"max_rss={report['max_rss_mb']:.1f} MB"
+    if "peak_traced_mb" in report:
+        memory += f"  peak_traced={report['peak_traced_mb']:.1f} MB"
+    print(f"\nconcurrency={report['concurrency']}  total={report['throughput']:.1f} req/s  {memory}")
+    print(f"{'operation':<16}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, op in report["operations"].items():
+        print(f"{name:<16}{op['requests']:>10}{op['errors']:>8}{op['throughput']:>10.1f}"
+              f"{op['p50_ms']:>10.1f}{op['p95_ms']:>10.1f}{op['p99_ms']:>10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated worker counts")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation=weight pairs")
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="fake model time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=400, help="fake model output rate")
+    parser.add_argument("--output-tokens", type=int, default=300, help="fake model reply length")
+    parser.add_argument("--s3-latency", type=float, default=0.02, help="fake S3 latency per request (s)")
+    parser.add_argument("--page-paragraphs", type=int, default=40, help="size of each benchmark page")
+    parser.add_argument("--trace-memory", action="store_true", help="track peak Python allocations (slower)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    # The app reads its database path and client mode at import time
+    workdir = tempfile.mkdtemp(prefix="blog-bench-")
+    os.environ["BLOG_DB_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ["BLOG_FAKE_AWS"] = "1"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    warnings.filterwarnings("ignore", module="jwt")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import jwt
+    import app as app_module
+    from fakes import FakeBedrockClient, FakeS3Client
+
+    app_module.init_clients(
+        FakeBedrockClient(
+            first_token_latency=args.first_token_latency,
+            tokens_per_second=args.tokens_per_second,
+            output_tokens=args.output_tokens,
+        ),
+        FakeS3Client(latency=args.s3_latency),
+    )
+    mix = parse_mix(args.mix)
+    reports = []
+    for level in [int(c) for c in args.concurrency.split(",")]:
+        workers = []
+        for i in range(level):
+            user_id = 1000 + i
+            token = jwt.encode({"user_id": user_id}, app_module.SECRET_KEY, algorithm="HS256")
+            headers = {"Authorization": f"Bearer {token}"}
+            topic_id = app_module.db.create_topic(user_id, f"bench {level}/{i}")
+            worker = Worker(app_module, headers, user_id, topic_id, args.page_paragraphs)
+            # Start from a saved page so reads don't 404
+            worker.save_webpage()
+            workers.append(worker)
+        if args.trace_memory:
+            tracemalloc.start()
+        report = run_level(app_module, workers, mix, args.duration)
+        if args.trace_memory:
+            report["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.stop()
+        report["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        reports.append(report)
+        if not args.json:
+            print_report(report)
+    if args.json:
+        print(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    main()
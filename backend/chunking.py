@@ -0,0 +1,217 @@
+import re
+
+# Section boundaries, taken among sibling elements so every section is balanced
+# markup: <section>/<article> blocks when a level has them, otherwise h1-h3 headings;
+# markdown documents split on #, ## and ### headings.
+BLOCK_TAGS = {"section", "article"}
+HEADING_TAGS = {"h1", "h2", "h3"}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+RAW_TEXT_TAGS = {"script", "style", "textarea", "title"}
+# Start tags that close an open <p>, and list items that close the previous item
+P_CLOSING_TAGS = {
+    "address", "article", "aside", "blockquote", "details", "div", "dl", "fieldset", "figcaption", "figure",
+    "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "main", "nav", "ol", "p", "pre",
+    "section", "table", "ul",
+}
+ITEM_TAGS = {"li": {"li"}, "dt": {"dt", "dd"}, "dd": {"dt", "dd"}}
+MARKUP_RE = re.compile(
+    r"<!--.*?-->|<!\[CDATA\[.*?\]\]>|<[!?][^>]*>"
+    r"|<(/?)([a-zA-Z][a-zA-Z0-9-]*)((?:\"[^\"]*\"|'[^']*'|[^'\">])*)>",
+    re.DOTALL,
+)
+MARKDOWN_HEADING_RE = re.compile(r"^#{1,3}\s", re.MULTILINE)
+HEADING_TEXT_RE = re.compile(r"<h[1-6][^>]*>(.*?)</h[1-6]>", re.IGNORECASE | re.DOTALL)
+TAG_RE = re.compile(r"<[^>]+>")
+# Markup that does not render as page text
+HIDDEN_RE = re.compile(
+    r"<!--.*?-->|<(head|script|style|template|title)\b.*?(?:</\1\s*>|$)", re.IGNORECASE | re.DOTALL
+)
+# Prompts about the page's styles or <head>, which section mode never sends
+DOCUMENT_PROMPT_RE = re.compile(
+    r"\b(?:css|styles?|styling|stylesheet|fonts?|typography|colou?rs?|theme|dark mode|background|layout|"
+    r"spacing|margins?|padding|head|meta|favicon|title tag)\b",
+    re.IGNORECASE,
+)
+WORD_RE = re.compile(r"[a-z0-9]+")
+SECTION_NUMBER_RE = re.compile(r"\b(?:section|part|chapter)\s+(\d+)\b", re.IGNORECASE)
+
+STOPWORDS = {
+    "the", "and", "for", "with", "this", "that", "make", "more", "less", "into", "from", "about", "please",
+    "section", "part", "chapter", "paragraph", "text", "content", "rewrite", "change", "update", "modify",
+    "improve", "should", "would", "could", "than", "them", "then", "have", "your", "their", "there", "which",
+    "what", "some",
+}
+
+
+# The request names sections (by id or "section N") that the document does not have
+class SectionNotFound(ValueError):
+    pass
+
+
+def strip_tags(text):
+    return TAG_RE.sub(" ", text)
+
+
+def section_heading(text):
+    match = HEADING_TEXT_RE.search(text)
+    if match:
+        return " ".join(strip_tags(match.group(1)).split())
+    if text.lstrip().startswith("#"):
+        return text.lstrip().split("\n", 1)[0].lstrip("#").strip()
+    return ""
+
+
+# Element spans: start/end include the element's tags, inner_start/inner_end only
+# its content
+class Element:
+    def __init__(self, tag, start, inner_start):
+        self.tag = tag
+        self.start = start
+        self.inner_start = inner_start
+        self.end = None
+        self.inner_end = None
+        self.children = []
+
+    def close(self, end, inner_end):
+        self.end = end
+        self.inner_end = inner_end
+
+
+# Element tree of an HTML document, tolerant of unclosed tags: an end tag closes
+# everything opened after its start tag, block tags close an open <p> as browsers
+# do, and stray end tags are ignored
+def parse_elements(text):
+    root = Element(None, 0, 0)
+    stack = [root]
+    pos = 0
+    while True:
+        match = MARKUP_RE.search(text, pos)
+        if not match:
+            break
+        pos = match.end()
+        closing, tag = match.group(1), (match.group(2) or "").lower()
+        if not tag:
+            continue
+        if closing:
+            if any(e.tag == tag for e in stack[1:]):
+                while True:
+                    element = stack.pop()
+                    element.close(match.end() if element.tag == tag else match.start(), match.start())
+                    if element.tag == tag:
+                        break
+            continue
+        implied = ITEM_TAGS.get(tag, set()) | ({"p"} if tag in P_CLOSING_TAGS else set())
+        if stack[-1].tag in implied:
+            stack.pop().close(match.start(), match.start())
+        element = Element(tag, match.start(), match.end())
+        stack[-1].children.append(element)
+        if tag in VOID_TAGS or match.group(3).rstrip().endswith("/"):
+            element.close(match.end(), match.end())
+        elif tag in RAW_TEXT_TAGS:
+            close = re.compile(rf"</{tag}\s*>", re.IGNORECASE).search(text, pos)
+            pos = close.end() if close else len(text)
+            element.close(pos, close.start() if close else len(text))
+        else:
+            stack.append(element)
+    for element in stack:
+        element.close(len(text), len(text))
+    return root
+
+
+# Section starts among one element's children, or None if it has fewer than two
+def child_boundaries(element):
+    for tags in (BLOCK_TAGS, HEADING_TAGS):
+        starts = [child.start for child in element.children if child.tag in tags]
+        if len(starts) >= 2:
+            return starts
+    return None
+
+
+# Look down through wrapper elements (<html>, <body>, <main>, a lone <article>...),
+# largest first, for a level with at least two section boundaries.
+# Returns (boundaries, that level's element), or (None, None).
+def html_boundaries(element):
+    boundaries = child_boundaries(element)
+    if boundaries:
+        return boundaries, element
+    for child in sorted(element.children, key=lambda child: child.start - child.end):
+        boundaries, container = html_boundaries(child)
+        if boundaries:
+            return boundaries, container
+    return None, None
+
+
+# Whether a piece of markup shows any text on the page
+def has_visible_text(text):
+    return bool(strip_tags(HIDDEN_RE.sub("", text)).strip())
+
+
+# Split a document into (head, sections, tail) so that head + sections + tail
+# concatenate back to the original text. Visible content ahead of the first
+# boundary becomes an intro section; head and tail are the markup around the
+# sections and are never sent to the model.
+def split_document(text):
+    if "<" in text:
+        boundaries, container = html_boundaries(parse_elements(text))
+        body_start, body_end = (container.inner_start, container.inner_end) if container else (0, len(text))
+    else:
+        boundaries, body_start, body_end = [m.start() for m in MARKDOWN_HEADING_RE.finditer(text)], 0, len(text)
+    if not boundaries or len(boundaries) < 2:
+        return "", [{"id": 0, "heading": section_heading(text), "text": text}], ""
+    if has_visible_text(text[body_start:boundaries[0]]):
+        boundaries = [body_start] + boundaries
+
+    sections = []
+    edges = boundaries + [body_end]
+    for i, (start, end) in enumerate(zip(edges, edges[1:])):
+        chunk = text[start:end]
+        sections.append({"id": i, "heading": section_heading(chunk), "text": chunk})
+    return text[:boundaries[0]], sections, text[body_end:]
+
+
+# The prompt is about the page's styles or <head> and needs the whole document
+def targets_document(prompt):
+    return bool(DOCUMENT_PROMPT_RE.search(prompt or ""))
+
+
+def keywords(text):
+    return {word for word in WORD_RE.findall(text.lower()) if len(word) > 3 and word not in STOPWORDS}
+
+
+def check_sections(sections, wanted, label):
+    missing = sorted(wanted - {s["id"] for s in sections})
+    if missing:
+        names = ", ".join(label(i) for i in missing)
+        raise SectionNotFound(f"No {names} in this document; it has {len(sections)} sections")
+    return sorted(wanted)
+
+
+# Sections the prompt refers to: explicit ids, "section N", or words shared with a
+# heading (or, failing that, the body). An empty result means the edit is global;
+# explicit ids or numbers the document does not have raise SectionNotFound.
+def select_sections(sections, prompt, section_ids=None):
+    if section_ids:
+        return check_sections(sections, {int(i) for i in section_ids}, lambda i: f"section id {i}")
+
+    numbered = {int(n) - 1 for n in SECTION_NUMBER_RE.findall(prompt or "")}
+    if numbered:
+        return check_sections(sections, numbered, lambda i: f"section {i + 1}")
+
+    words = keywords(prompt or "")
+    if not words:
+        return []
+    by_heading = [s["id"] for s in sections if words & keywords(s["heading"])]
+    if by_heading:
+        return by_heading
+    scores = [(len(words & keywords(strip_tags(s["text"]))), s["id"]) for s in sections]
+    best = max(score for score, _ in scores)
+    # Body matches only count when they single out part of the document
+    if best == 0:
+        return []
+    selected = [section_id for score, section_id in scores if score == best]
+    return selected if len(selected) < len(sections) else []
+
+
+def stitch(head, sections, replacements, tail):
+    return head + "".join(replacements.get(s["id"], s["text"]) for s in sections) + tail
+
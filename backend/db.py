@@ -0,0 +1,302 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import TimedConnection
+
+DB_PATH = os.environ.get("BLOG_DB_PATH", "blog_content.db")
+
+BUSY_TIMEOUT_MS = 5000
+
+# Applied to every new connection. WAL lets readers run alongside a writer,
+# synchronous=NORMAL is durable enough under WAL and avoids an fsync per commit.
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA temp_store=MEMORY",
+]
+
+# Number of prepared statements kept per connection
+STATEMENT_CACHE_SIZE = 256
+
+
+def open_connection(path):
+    # Autocommit mode; transactions are opened explicitly with transaction()
+    conn = sqlite3.connect(
+        path, timeout=10, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE, factory=TimedConnection
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# One long-lived connection per thread, opened on first use
+class ConnectionPool:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def get(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = open_connection(self.path)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        conn = self.get()
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+pool = ConnectionPool(DB_PATH)
+
+
+def get_connection():
+    return pool.get()
+
+
+def transaction(immediate=False):
+    return pool.transaction(immediate)
+
+
+# Run an optional write without waiting for the write lock. Returns False if
+# another connection holds it, for writes that only refresh derived data.
+def try_execute(sql, params=()):
+    conn = get_connection()
+    conn.execute("PRAGMA busy_timeout=0")
+    try:
+        conn.execute(sql, params)
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+
+
+# Initialize SQLite Database
+def init_db():
+    with transaction(immediate=True) as conn:
+        # Users table
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL
+        )''')
+
+        # Topics table
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS topics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            title TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )''')
+
+        # Blogs table
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS blogs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            topic_id INTEGER,
+            blog_title TEXT,
+            title TEXT,
+            introduction TEXT,
+            body TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (topic_id) REFERENCES topics(id)
+        )''')
+
+        # Webpages table (content lives in webpage_snapshots/webpage_deltas, see pages.py)
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS webpages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            topic_id INTEGER,
+            html_content TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (topic_id) REFERENCES topics(id)
+        )''')
+
+        # Background generation jobs
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            callback_url TEXT,
+            owner TEXT,
+            lease_expires REAL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )''')
+        # Lease columns were added after the jobs table
+        job_columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+        if "owner" not in job_columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            conn.execute("ALTER TABLE jobs ADD COLUMN lease_expires REAL")
+
+        # Dimensions and resized variants of stored images, keyed by content hash
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS images (
+            digest TEXT PRIMARY KEY,
+            key TEXT NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            variants TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )''')
+
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_topics_user ON topics (user_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_webpages_user_topic ON webpages (user_id, topic_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+
+
+# Users
+def create_user(username, password_hash):
+    # Raises sqlite3.IntegrityError if the username is taken
+    get_connection().execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password_hash))
+
+
+def get_user_by_username(username):
+    return get_connection().execute("SELECT id, password FROM users WHERE username = ?", (username,)).fetchone()
+
+
+# Topics
+def list_topics(user_id):
+    rows = get_connection().execute("SELECT id, title FROM topics WHERE user_id = ?", (user_id,)).fetchall()
+    return [{"id": row[0], "title": row[1]} for row in rows]
+
+
+def create_topic(user_id, title):
+    cursor = get_connection().execute("INSERT INTO topics (user_id, title) VALUES (?, ?)", (user_id, title))
+    return cursor.lastrowid
+
+
+# Jobs
+def create_job(job_id, user_id, kind, payload, callback_url=None):
+    now = time.time()
+    get_connection().execute(
+        "INSERT INTO jobs (id, user_id, kind, payload, status, callback_url, created_at, updated_at) "
+        "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+        (job_id, user_id, kind, json.dumps(payload), callback_url, now, now),
+    )
+
+
+def get_job(job_id):
+    row = get_connection().execute(
+        "SELECT id, user_id, kind, payload, status, result, error, callback_url, created_at, updated_at "
+        "FROM jobs WHERE id = ?",
+        (job_id,),
+    ).fetchone()
+    if not row:
+        return None
+    return {
+        "id": row[0],
+        "user_id": row[1],
+        "kind": row[2],
+        "payload": json.loads(row[3]),
+        "status": row[4],
+        "result": json.loads(row[5]) if row[5] else None,
+        "error": row[6],
+        "callback_url": row[7],
+        "created_at": row[8],
+        "updated_at": row[9],
+    }
+
+
+def claim_job(job_id, owner, lease_seconds):
+    # Only one worker can move a job from queued to running; it holds the job
+    # while it keeps renewing the lease
+    now = time.time()
+    cursor = get_connection().execute(
+        "UPDATE jobs SET status = 'running', owner = ?, lease_expires = ?, updated_at = ? "
+        "WHERE id = ? AND status = 'queued'",
+        (owner, now + lease_seconds, now, job_id),
+    )
+    return cursor.rowcount == 1
+
+
+def renew_job_leases(owner, lease_seconds):
+    get_connection().execute(
+        "UPDATE jobs SET lease_expires = ? WHERE owner = ? AND status = 'running'",
+        (time.time() + lease_seconds, owner),
+    )
+
+
+def finish_job(job_id, owner, result=None, error=None):
+    # A worker whose lease ran out may no longer own the job; its result is dropped
+    status = "failed" if error else "done"
+    cursor = get_connection().execute(
+        "UPDATE jobs SET status = ?, result = ?, error = ?, owner = NULL, lease_expires = NULL, updated_at = ? "
+        "WHERE id = ? AND owner = ? AND status = 'running'",
+        (status, json.dumps(result) if result is not None else None, error, time.time(), job_id, owner),
+    )
+    return cursor.rowcount == 1
+
+
+def requeue_expired_jobs():
+    # Running jobs whose worker stopped renewing the lease (it crashed or was
+    # restarted) go back to the queue. Jobs held by live workers are left alone.
+    with transaction(immediate=True) as conn:
+        now = time.time()
+        rows = conn.execute(
+            "SELECT id, user_id FROM jobs WHERE status = 'running' AND (lease_expires IS NULL OR lease_expires < ?) "
+            "ORDER BY created_at",
+            (now,),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE jobs SET status = 'queued', owner = NULL, lease_expires = NULL, updated_at = ? WHERE id = ?",
+            [(now, row[0]) for row in rows],
+        )
+    return rows
+
+
+def queued_jobs():
+    # Oldest first. Other processes may hold some of these in memory too; claim_job
+    # makes sure each one runs once.
+    return get_connection().execute(
+        "SELECT id, user_id FROM jobs WHERE status = 'queued' ORDER BY created_at"
+    ).fetchall()
+
+
+# Images
+
+
+def save_image(digest, key, width, height, variants):
+    get_connection().execute(
+        "INSERT OR REPLACE INTO images (digest, key, width, height, variants, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (digest, key, width, height, json.dumps(variants), time.time()),
+    )
+
+
+def get_image(digest):
+    row = get_connection().execute(
+        "SELECT key, width, height, variants FROM images WHERE digest = ?", (digest,)
+    ).fetchone()
+    if not row:
+        return None
+    return {"key": row[0], "width": row[1], "height": row[2], "variants": json.loads(row[3])}
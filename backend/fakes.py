@@ -0,0 +1,228 @@
+import base64
+import io
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+
+from botocore.exceptions import ClientError
+from botocore.hooks import HierarchicalEmitter
+
+import prompts
+
+# In-process stand-ins for the bedrock-runtime and s3 clients, for benchmarks and
+# offline runs (BLOG_FAKE_AWS=1). They emit the same before-call/after-call events as
+# botocore so metrics.instrument_client works unchanged.
+
+LOREM = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut "
+    "labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco "
+    "laboris nisi ut aliquip ex ea commodo consequat. "
+).split()
+
+
+def client_error(code, operation, status=400, message=""):
+    return ClientError({"Error": {"Code": code, "Message": message or code}, "ResponseMetadata": {"HTTPStatusCode": status}}, operation)
+
+
+# Small valid PNG filled with one colour
+def make_png(width=64, height=32, seed=0):
+    rng = random.Random(seed)
+    pixel = bytes(rng.randrange(256) for _ in range(3))
+    raw = b"".join(b"\x00" + pixel * width for _ in range(height))
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+
+class FakeClient:
+    service = "fake"
+
+    def __init__(self, error_rate=0.0, throttle_rate=0.0):
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.meta = SimpleNamespace(events=HierarchicalEmitter())
+
+    def _call(self, operation, fn):
+        context = {}
+        model = SimpleNamespace(name=operation)
+        self.meta.events.emit(f"before-call.{self.service}.{operation}", model=model, params={}, context=context)
+        with self._lock:
+            self.calls += 1
+        try:
+            roll = random.random()
+            if roll < self.throttle_rate:
+                raise client_error("ThrottlingException", operation, 429, "Too many requests")
+            if roll < self.throttle_rate + self.error_rate:
+                raise client_error("InternalServerException", operation, 500)
+            result = fn()
+        except ClientError as e:
+            self.meta.events.emit(
+                f"after-call.{self.service}.{operation}", http_response=None, parsed=e.response, model=model, context=context
+            )
+            raise
+        self.meta.events.emit(
+            f"after-call.{self.service}.{operation}", http_response=None, parsed={}, model=model, context=context
+        )
+        return result
+
+
+# Simulates model latency as a fixed time to first token plus a token rate
+class FakeBedrockClient(FakeClient):
+    service = "bedrock-runtime"
+
+    def __init__(self, first_token_latency=0.3, tokens_per_second=400, output_tokens=300, image_latency=1.0,
+                 chunk_tokens=5, **kwargs):
+        super().__init__(**kwargs)
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.image_latency = image_latency
+        self.chunk_tokens = chunk_tokens
+        self._cached_prefixes = set()
+
+    # Usage for a call, with system text before a cachePoint read from the prompt cache
+    # after the first call that wrote it. Like Bedrock, prefixes under the model's
+    # minimum are not cached.
+    def _usage(self, messages, system, output_tokens):
+        usage = {"inputTokens": self._input_tokens(messages, system), "outputTokens": output_tokens}
+        prefix = []
+        for block in system or []:
+            if "cachePoint" in block:
+                cached = len("".join(prefix)) // 4
+                if cached < prompts.MIN_CACHE_TOKENS:
+                    break
+                with self._lock:
+                    hit = tuple(prefix) in self._cached_prefixes
+                    self._cached_prefixes.add(tuple(prefix))
+                usage["inputTokens"] = max(0, usage["inputTokens"] - cached)
+                usage["cacheReadInputTokens"] = cached if hit else 0
+                usage["cacheWriteInputTokens"] = 0 if hit else cached
+                break
+            prefix.append(block.get("text", ""))
+        usage["totalTokens"] = (usage["inputTokens"] + output_tokens + usage.get("cacheReadInputTokens", 0)
+                                + usage.get("cacheWriteInputTokens", 0))
+        return usage
+
+    def _input_tokens(self, messages, system):
+        text = " ".join(block.get("text", "") for message in messages for block in message["content"])
+        text += " ".join(block.get("text", "") for block in system or [])
+        return max(1, len(text) // 4)
+
+    def _output_tokens(self, inference_config):
+        return min(self.output_tokens, (inference_config or {}).get("maxTokens", self.output_tokens))
+
+    def _words(self, count):
+        return [LOREM[i % len(LOREM)] for i in range(count)]
+
+    def converse(self, modelId, messages, system=None, inferenceConfig=None, **kwargs):
+        def call():
+            output_tokens = self._output_tokens(inferenceConfig)
+            time.sleep(self.first_token_latency + output_tokens / self.tokens_per_second)
+            stop_reason = "max_tokens" if output_tokens < self.output_tokens else "end_turn"
+            return {
+                "output": {"message": {"role": "assistant", "content": [{"text": " ".join(self._words(output_tokens))}]}},
+                "stopReason": stop_reason,
+                "usage": self._usage(messages, system, output_tokens),
+            }
+
+        return self._call("Converse", call)
+
+    def converse_stream(self, modelId, messages, system=None, inferenceConfig=None, **kwargs):
+        output_tokens = self._output_tokens(inferenceConfig)
+
+        def events():
+            time.sleep(self.first_token_latency)
+            yield {"messageStart": {"role": "assistant"}}
+            words = self._words(output_tokens)
+            for i in range(0, len(words), self.chunk_tokens):
+                time.sleep(self.chunk_tokens / self.tokens_per_second)
+                chunk = " ".join(words[i:i + self.chunk_tokens])
+                yield {"contentBlockDelta": {"contentBlockIndex": 0, "delta": {"text": chunk + " "}}}
+            yield {"contentBlockStop": {"contentBlockIndex": 0}}
+            stop_reason = "max_tokens" if output_tokens < self.output_tokens else "end_turn"
+            yield {"messageStop": {"stopReason": stop_reason}}
+            yield {"metadata": {"usage": self._usage(messages, system, output_tokens)}}
+
+        return self._call("ConverseStream", lambda: {"stream": events()})
+
+    def invoke_model(self, modelId, body, **kwargs):
+        def call():
+            request = json.loads(body)
+            config = request.get("imageGenerationConfig", {})
+            count = config.get("numberOfImages", 1)
+            seed = config.get("seed", 0)
+            time.sleep(self.image_latency)
+            images = [base64.b64encode(make_png(seed=seed * 10 + i)).decode("ascii") for i in range(count)]
+            return {"body": io.BytesIO(json.dumps({"images": images}).encode("utf-8"))}
+
+        return self._call("InvokeModel", call)
+
+
+# In-memory bucket with a fixed per-request latency
+class FakeS3Client(FakeClient):
+    service = "s3"
+
+    def __init__(self, latency=0.02, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.objects = {}
+
+    def _store(self, bucket, key, body, extra):
+        if hasattr(body, "read"):
+            body = body.read()
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        with self._lock:
+            self.objects[(bucket, key)] = (body, extra)
+
+    def _get(self, bucket, key, operation):
+        with self._lock:
+            stored = self.objects.get((bucket, key))
+        if stored is None:
+            raise client_error("404" if operation == "HeadObject" else "NoSuchKey", operation, 404)
+        return stored
+
+    def put_object(self, Bucket, Key, Body=b"", **kwargs):
+        def call():
+            time.sleep(self.latency)
+            self._store(Bucket, Key, Body, kwargs)
+            return {"ETag": '"fake"'}
+
+        return self._call("PutObject", call)
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None, **kwargs):
+        def call():
+            time.sleep(self.latency)
+            self._store(Bucket, Key, Fileobj, ExtraArgs or {})
+
+        return self._call("PutObject", call)
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, **kwargs):
+        with open(Filename, "rb") as f:
+            return self.upload_fileobj(f, Bucket, Key, ExtraArgs=ExtraArgs)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        def call():
+            time.sleep(self.latency)
+            body, extra = self._get(Bucket, Key, "HeadObject")
+            return {"ContentLength": len(body), "Metadata": extra.get("Metadata", {})}
+
+        return self._call("HeadObject", call)
+
+    def get_object(self, Bucket, Key, **kwargs):
+        def call():
+            time.sleep(self.latency)
+            body, extra = self._get(Bucket, Key, "GetObject")
+            return {"Body": io.BytesIO(body), "ContentLength": len(body), "Metadata": extra.get("Metadata", {})}
+
+        return self._call("GetObject", call)
@@ -0,0 +1,222 @@
+import hashlib
+import re
+from html import escape
+from html.parser import HTMLParser
+
+from llm_cache import MemoryStore
+
+# Bumped whenever the output changes, so published pages are rebuilt
+PIPELINE_VERSION = "2"
+
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+# Whitespace next to these tags does not render and is dropped
+BLOCK_TAGS = {
+    "html", "head", "body", "div", "p", "section", "article", "header", "footer", "main", "nav", "aside", "h1",
+    "h2", "h3", "h4", "h5", "h6", "ul", "ol", "li", "dl", "dt", "dd", "table", "thead", "tbody", "tfoot", "tr",
+    "td", "th", "caption", "figure", "figcaption", "blockquote", "form", "fieldset", "hr", "br", "pre",
+}
+# Never rendered: written as is, leaving the whitespace around them to their neighbours
+HIDDEN_TAGS = {"base", "link", "meta", "script", "style", "title"}
+# Content kept exactly as written
+PRESERVE_TAGS = {"pre", "textarea", "script"}
+
+WHITESPACE_RE = re.compile(r"\s+")
+CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.DOTALL)
+CSS_STRING_RE = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')""")
+CSS_PUNCTUATION_RE = re.compile(r"\s*([{};,>])\s*")
+# Images stored by images.store_upload / store_image: .../uploads/[generated/]<sha256>.<ext>
+UPLOAD_URL_RE = re.compile(r"/uploads/(?:generated/)?([0-9a-f]{64})\.\w+$")
+
+
+def minify_css(css):
+    parts = CSS_STRING_RE.split(CSS_COMMENT_RE.sub("", css))
+    for i in range(0, len(parts), 2):
+        # Even parts are outside string literals
+        text = WHITESPACE_RE.sub(" ", parts[i])
+        text = CSS_PUNCTUATION_RE.sub(r"\1", text)
+        parts[i] = text.replace(": ", ":").replace(";}", "}")
+    return "".join(parts).strip()
+
+
+def format_attrs(attrs):
+    out = []
+    for name, value in attrs:
+        out.append(f" {name}" if value is None else f' {name}="{escape(value, quote=True)}"')
+    return "".join(out)
+
+
+# Streaming HTML rewriter: feed() chunks and collect the output as it is produced.
+# Drops comments (except conditional ones), collapses whitespace, minifies <style>
+# blocks and adds lazy loading, async decoding, dimensions and a srcset to images.
+# image_info(src) returns {"width", "height", "srcset"} for a known image, or None.
+class HtmlTransformer(HTMLParser):
+    def __init__(self, image_info=None):
+        super().__init__(convert_charrefs=False)
+        self.image_info = image_info
+        self.out = []
+        self.stack = []
+        self.pending_space = False
+        self.after_block = True
+        self.images_seen = 0
+        self.style = None
+
+    def _preserving(self):
+        return any(tag in PRESERVE_TAGS for tag in self.stack)
+
+    def _hidden(self):
+        return any(tag in HIDDEN_TAGS for tag in self.stack)
+
+    def _emit(self, text, block=False):
+        if self._hidden():
+            self.out.append(text)
+            return
+        if self.pending_space and not block and not self.after_block:
+            self.out.append(" ")
+        self.pending_space = False
+        self.out.append(text)
+        self.after_block = block
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "img":
+            self._emit(self._image_tag(attrs))
+            return
+        self._tag(tag, self.get_starttag_text())
+        if tag == "style":
+            # Collected until </style> so chunk boundaries cannot split a CSS token
+            self.style = []
+        if tag not in VOID_TAGS:
+            self.stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag == "img":
+            self._emit(self._image_tag(attrs))
+            return
+        self._tag(tag, self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        self._flush_style()
+        if tag in self.stack:
+            while self.stack and self.stack.pop() != tag:
+                pass
+        if tag not in VOID_TAGS:
+            self._tag(tag, f"</{tag}>")
+
+    def _tag(self, tag, text):
+        if tag in HIDDEN_TAGS:
+            self.out.append(text)
+        else:
+            self._emit(text, block=tag in BLOCK_TAGS)
+
+    def _flush_style(self):
+        if self.style is not None:
+            self.out.append(minify_css("".join(self.style)))
+            self.style = None
+
+    def handle_data(self, data):
+        if self.style is not None:
+            self.style.append(data)
+        elif self._hidden():
+            self.out.append(data)
+        elif self._preserving():
+            self._emit(data)
+        else:
+            collapsed = WHITESPACE_RE.sub(" ", data)
+            if not collapsed.strip():
+                self.pending_space = True
+                return
+            if collapsed[0] == " ":
+                self.pending_space = True
+            self._emit(collapsed.strip())
+            self.pending_space = collapsed[-1] == " "
+
+    def handle_entityref(self, name):
+        self._emit(f"&{name};")
+
+    def handle_charref(self, name):
+        self._emit(f"&#{name};")
+
+    def handle_comment(self, data):
+        # Conditional comments and <!--! ... --> notices are kept
+        if data.startswith(("[if", "<![endif]", "!")):
+            self._emit(f"<!--{data}-->")
+
+    def handle_decl(self, decl):
+        self._emit(f"<!{decl}>", block=True)
+
+    def handle_pi(self, data):
+        self._emit(f"<?{data}>")
+
+    def unknown_decl(self, data):
+        self._emit(f"<![{data}]>")
+
+    def _image_tag(self, attrs):
+        values = dict(attrs)
+        names = {name for name, _ in attrs}
+        added = []
+        self.images_seen += 1
+        # The first image is usually above the fold; lazy loading it would delay it
+        if "loading" not in names and self.images_seen > 1:
+            added.append(("loading", "lazy"))
+        if "decoding" not in names:
+            added.append(("decoding", "async"))
+        info = self.image_info(values["src"]) if self.image_info and values.get("src") else None
+        if info:
+            if "width" not in names and "height" not in names and info.get("width") and info.get("height"):
+                added += [("width", str(info["width"])), ("height", str(info["height"]))]
+            if "srcset" not in names and info.get("srcset"):
+                added.append(("srcset", info["srcset"]))
+                if "sizes" not in names and info.get("width"):
+                    added.append(("sizes", f"(max-width: {info['width']}px) 100vw, {info['width']}px"))
+        return f"<img{format_attrs(list(attrs) + added)}>"
+
+    def feed(self, data):
+        super().feed(data)
+        return self.drain()
+
+    def close(self):
+        # Text of an unterminated <script> or <style> is held back waiting for its end
+        # tag, and some Python versions drop it on close
+        if self.cdata_elem and self.rawdata:
+            self.handle_data(self.rawdata)
+            self.rawdata = ""
+        super().close()
+        self._flush_style()
+        if self.pending_space and not self.after_block:
+            self.out.append(" ")
+        self.pending_space = False
+        return self.drain()
+
+    def drain(self):
+        text = "".join(self.out)
+        self.out = []
+        return text
+
+
+def transform_html(html, image_info=None):
+    transformer = HtmlTransformer(image_info)
+    return transformer.feed(html) + transformer.close()
+
+
+# Digest of the stored image an URL points at, if it is one of ours
+def upload_digest(url):
+    match = UPLOAD_URL_RE.search(url.split("?", 1)[0])
+    return match.group(1) if match else None
+
+
+# Publish-time transform with results cached by input hash. Callable, with a version
+# string that publish.publish_pages mixes into the page hash.
+class HtmlPipeline:
+    version = PIPELINE_VERSION
+
+    def __init__(self, image_info=None, max_entries=256, max_bytes=32 * 1024 * 1024):
+        self.image_info = image_info
+        self.cache = MemoryStore(max_entries=max_entries, max_bytes=max_bytes)
+
+    def __call__(self, html):
+        key = hashlib.sha256(html.encode("utf-8")).hexdigest()
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        result = transform_html(html, self.image_info)
+        self.cache.set(key, result)
+        return result
@@ -0,0 +1,236 @@
+import base64
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import random
+import tempfile
+from concurrent.futures import as_completed
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+import bedrock
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it uploads get no resized variants
+    Image = None
+
+# Nova Canvas returns at most this many images per invoke_model call
+MAX_IMAGES_PER_CALL = 5
+
+# Uploads are read in chunks and spooled to disk past this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_SPOOL_SIZE = 8 * 1024 * 1024
+
+# Files above the threshold go up as multipart uploads
+upload_transfer_config = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=4,
+)
+
+# Responsive variants generated for uploaded images
+VARIANT_WIDTHS = (320, 640, 1024, 1600)
+VARIANT_FORMATS = (("webp", "WEBP", "image/webp"), ("avif", "AVIF", "image/avif"))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Size of images generated with Nova Canvas
+GENERATED_WIDTH = 800
+GENERATED_HEIGHT = 400
+
+
+def s3_url(region, bucket, key):
+    return f"https://s3.{region}.amazonaws.com/{bucket}/{key}"
+
+
+def object_exists(s3, bucket, key):
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+
+# Ask the image model for `count` images of one prompt in a single call, returning
+# the decoded bytes. Raises bedrock.BedrockError if fewer images come back (the
+# model drops images its content filters block).
+def generate_image_bytes(client, model_id, prompt, count=1, width=GENERATED_WIDTH, height=GENERATED_HEIGHT):
+    if not 1 <= count <= MAX_IMAGES_PER_CALL:
+        raise ValueError(f"count must be between 1 and {MAX_IMAGES_PER_CALL}")
+    native_request = {
+        "taskType": "TEXT_IMAGE",
+        "textToImageParams": {"text": prompt},
+        "imageGenerationConfig": {
+            "seed": random.randint(0, 858993460),
+            "quality": "standard",
+            "height": height,
+            "width": width,
+            "numberOfImages": count,
+        },
+    }
+    response = client.invoke_model(modelId=model_id, body=json.dumps(native_request))
+    model_response = json.loads(response["body"].read())
+    images = [base64.b64decode(image) for image in model_response.get("images") or []]
+    if len(images) < count:
+        reason = model_response.get("error") or "no reason given"
+        raise bedrock.BedrockError(f"Image model returned {len(images)} of {count} images: {reason}")
+    return images
+
+
+# Store image bytes under a key derived from their hash; identical images are uploaded once
+def store_image(s3, bucket, data, prefix="uploads/generated", extension="png", content_type="image/png"):
+    key = f"{prefix}/{hashlib.sha256(data).hexdigest()}.{extension}"
+    if not object_exists(s3, bucket, key):
+        s3.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=data,
+            ContentType=content_type,
+            CacheControl=IMMUTABLE_CACHE_CONTROL,
+        )
+    return key
+
+
+# Generate images for several (prompt, count) pairs and upload them in parallel.
+# Model calls and uploads are both submitted from this thread, so pool workers
+# never wait on each other. Returns the S3 keys for each request, in order.
+def generate_and_store(client, s3, executor, model_id, bucket, requests):
+    keys = [[] for _ in requests]
+    calls = {}
+    for index, (prompt, count) in enumerate(requests):
+        # Split counts into separate calls so large batches also run in parallel
+        remaining = count
+        while remaining > 0:
+            batch = min(MAX_IMAGES_PER_CALL, remaining)
+            calls[executor.submit(generate_image_bytes, client, model_id, prompt, batch)] = index
+            remaining -= batch
+
+    uploads = []
+    for future in as_completed(calls):
+        index = calls[future]
+        for data in future.result():
+            uploads.append((index, executor.submit(store_image, s3, bucket, data)))
+
+    for index, future in uploads:
+        keys[index].append(future.result())
+    return keys
+
+
+# Copy an upload stream into a spooled temp file while hashing it
+def spool_and_hash(stream):
+    digest = hashlib.sha256()
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
+    size = 0
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        spool.write(chunk)
+        size += len(chunk)
+    spool.seek(0)
+    return spool, digest.hexdigest(), size
+
+
+def upload_extension(filename, content_type):
+    extension = os.path.splitext(filename or "")[1].lower()
+    if not extension[1:].isalnum() or len(extension) > 10:
+        extension = ""
+    if not extension and content_type:
+        extension = mimetypes.guess_extension(content_type) or ""
+    return extension
+
+
+# Store an uploaded file under uploads/<sha256><ext>, skipping the upload when the
+# same bytes are already in the bucket, and add resized variants for srcset
+def store_upload(s3, bucket, stream, filename, content_type, executor=None):
+    spool, digest, size = spool_and_hash(stream)
+    with spool:
+        key = f"uploads/{digest}{upload_extension(filename, content_type)}"
+        if not object_exists(s3, bucket, key):
+            s3.upload_fileobj(
+                spool,
+                bucket,
+                key,
+                ExtraArgs={"ContentType": content_type or "application/octet-stream", "CacheControl": IMMUTABLE_CACHE_CONTROL},
+                Config=upload_transfer_config,
+            )
+        spool.seek(0)
+        image = open_image(spool)
+        variants = store_variants(s3, bucket, image, digest, executor) if image is not None else []
+    return {
+        "key": key,
+        "digest": digest,
+        "size": size,
+        "width": image.width if image is not None else None,
+        "height": image.height if image is not None else None,
+        "variants": variants,
+    }
+
+
+def open_image(stream):
+    if Image is None:
+        return None
+    try:
+        image = Image.open(stream)
+        image.load()
+    except Exception:
+        return None
+    # Animated images are left alone; resizing would keep only the first frame
+    if getattr(image, "is_animated", False):
+        return None
+    return ImageOps.exif_transpose(image)
+
+
+def encode_variant(image, width, pil_format):
+    height = round(image.height * width / image.width)
+    resized = image.resize((width, height), Image.LANCZOS)
+    if resized.mode not in ("RGB", "RGBA"):
+        resized = resized.convert("RGBA" if "A" in resized.getbands() else "RGB")
+    out = io.BytesIO()
+    resized.save(out, format=pil_format, quality=80)
+    return out.getvalue(), height
+
+
+def store_variant(s3, bucket, image, digest, width, extension, pil_format, content_type):
+    key = f"uploads/{digest}/w{width}.{extension}"
+    height = round(image.height * width / image.width)
+    if not object_exists(s3, bucket, key):
+        try:
+            data, height = encode_variant(image, width, pil_format)
+        except (KeyError, OSError, ValueError):
+            # This Pillow build cannot write the format
+            return None
+        s3.put_object(Bucket=bucket, Key=key, Body=data, ContentType=content_type, CacheControl=IMMUTABLE_CACHE_CONTROL)
+    return {"key": key, "width": width, "height": height, "format": extension}
+
+
+# Resized WebP/AVIF copies at each configured width narrower than the original
+def store_variants(s3, bucket, image, digest, executor=None):
+    jobs = [
+        (width, extension, pil_format, content_type)
+        for extension, pil_format, content_type in VARIANT_FORMATS
+        for width in VARIANT_WIDTHS
+        if width < image.width
+    ]
+    if executor is None:
+        results = [store_variant(s3, bucket, image, digest, *job) for job in jobs]
+    else:
+        futures = [executor.submit(store_variant, s3, bucket, image, digest, *job) for job in jobs]
+        results = [future.result() for future in futures]
+    return [variant for variant in results if variant]
+
+
+# srcset attribute values per format, e.g. {"webp": "https://... 320w, https://... 640w"}
+def build_srcset(variants, url_for):
+    srcset = {}
+    for variant in variants:
+        entry = f"{url_for(variant['key'])} {variant['width']}w"
+        srcset.setdefault(variant["format"], []).append(entry)
+    return {fmt: ", ".join(entries) for fmt, entries in srcset.items()}
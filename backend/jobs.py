@@ -0,0 +1,192 @@
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from collections import deque
+
+import db
+from metrics import logger
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class InvalidCallbackError(ValueError):
+    pass
+
+
+# Bounded worker pool for generation jobs. Pending jobs are kept in one FIFO per
+# user and workers take from the users in round-robin order, so a user who
+# submits many jobs cannot starve everyone else.
+#
+# Several processes can share the jobs table. A running job is leased to the
+# process that claimed it, which renews the lease every lease_seconds / 3; jobs
+# whose lease runs out (the process died) are put back in the queue.
+class JobQueue:
+    def __init__(self, handlers, concurrency=4, max_pending=100, lease_seconds=60):
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._pending = {}
+        self._users = deque()
+        self._count = 0
+        self._cond = threading.Condition()
+        self._workers = []
+
+    def start(self):
+        if self._workers:
+            return
+        # Queued jobs may have been held in memory by a process that is gone
+        self._requeue_expired()
+        for job_id, user_id in db.queued_jobs():
+            self._push(user_id, job_id)
+        for i in range(self.concurrency):
+            worker = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        heartbeat = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        heartbeat.start()
+        self._workers.append(heartbeat)
+
+    def submit(self, user_id, kind, payload, callback_url=None):
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if callback_url:
+            check_callback_url(callback_url)
+        with self._cond:
+            if self._count >= self.max_pending:
+                raise QueueFullError("Too many pending jobs")
+        job_id = uuid.uuid4().hex
+        db.create_job(job_id, user_id, kind, payload, callback_url)
+        self._push(user_id, job_id)
+        return job_id
+
+    def pending(self):
+        with self._cond:
+            return self._count
+
+    def _push(self, user_id, job_id):
+        with self._cond:
+            queue = self._pending.get(user_id)
+            if queue is None:
+                queue = self._pending[user_id] = deque()
+                self._users.append(user_id)
+            queue.append(job_id)
+            self._count += 1
+            self._cond.notify()
+
+    def _pop(self):
+        with self._cond:
+            while not self._users:
+                self._cond.wait()
+            user_id = self._users.popleft()
+            queue = self._pending[user_id]
+            job_id = queue.popleft()
+            if queue:
+                self._users.append(user_id)
+            else:
+                del self._pending[user_id]
+            self._count -= 1
+            return job_id
+
+    def _requeue_expired(self):
+        for job_id, user_id in db.requeue_expired_jobs():
+            logger.warning("Job %s lost its worker; requeued", job_id)
+            self._push(user_id, job_id)
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                db.renew_job_leases(self.owner, self.lease_seconds)
+                self._requeue_expired()
+            except Exception:
+                logger.exception("Job lease heartbeat failed")
+
+    def _work(self):
+        while True:
+            job_id = self._pop()
+            try:
+                self._run(job_id)
+            except Exception:
+                logger.exception("Job %s crashed", job_id)
+
+    def _run(self, job_id):
+        if not db.claim_job(job_id, self.owner, self.lease_seconds):
+            return
+        job = db.get_job(job_id)
+        try:
+            result = self.handlers[job["kind"]](job["payload"])
+            finished = db.finish_job(job_id, self.owner, result=result)
+        except Exception as e:
+            finished = db.finish_job(job_id, self.owner, error=str(e))
+        if not finished:
+            logger.warning("Job %s finished after its lease was taken over; result dropped", job_id)
+            return
+        if job["callback_url"]:
+            notify_callback(job["callback_url"], public_job(db.get_job(job_id)))
+
+
+# Fields of a job that are returned to clients
+def public_job(job):
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+
+# Callback URLs must be http(s) and resolve only to public addresses, so a job
+# cannot make the server POST to internal services or cloud metadata endpoints.
+# Raises InvalidCallbackError.
+def check_callback_url(url):
+    try:
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError:
+        raise InvalidCallbackError("callback_url is not a valid URL")
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise InvalidCallbackError("callback_url must be an http(s) URL")
+    try:
+        infos = socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        raise InvalidCallbackError("callback_url host could not be resolved")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise InvalidCallbackError("callback_url must point to a public address")
+
+
+# Redirects are not followed: the target was not checked
+class NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+callback_opener = urllib.request.build_opener(NoRedirectHandler)
+
+
+def notify_callback(url, body):
+    request = urllib.request.Request(
+        url, data=json.dumps(body).encode("utf-8"), headers={"Content-Type": "application/json"}, method="POST"
+    )
+    try:
+        # Checked again in case the host now resolves somewhere else
+        check_callback_url(url)
+        callback_opener.open(request, timeout=10).close()
+    except Exception as e:
+        logger.warning("Job callback to %s failed: %s", url, e)
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from db import ConnectionPool
+
+
+# Build a content-addressed key from everything that affects the model output
+def make_cache_key(model_id, prompt, inference_config, system=None):
+    payload = json.dumps(
+        {"model": model_id, "prompt": prompt, "config": inference_config, "system": system},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# In-process LRU store, bounded by entry count and total size of cached text
+class MemoryStore:
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at)
+            self._size += len(value)
+            while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self._size -= len(value)
+
+
+# Local SQLite store so cached responses survive restarts and are shared between workers
+class SQLiteStore:
+    def __init__(self, path="llm_cache.db", max_entries=5000):
+        self.path = path
+        self.max_entries = max_entries
+        self._pool = ConnectionPool(path)
+        conn = self._pool.get()
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            expires_at REAL,
+            accessed_at REAL NOT NULL
+        )''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+
+    def get(self, key):
+        conn = self._pool.get()
+        row = conn.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row[1] is not None and row[1] < now:
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._pool.transaction(immediate=True) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+            conn.execute("DELETE FROM llm_cache WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        conn = self._pool.get()
+        conn.execute("DELETE FROM llm_cache")
+
+    def __len__(self):
+        return self._pool.get().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+
+# Response cache in front of the model, with hit/miss counters
+class ResponseCache:
+    def __init__(self, store, ttl=3600):
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self.store.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.store.set(key, value, ttl=self.ttl)
+
+    def stats(self):
+        return {
+            "backend": type(self.store).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.store),
+            "ttl": self.ttl,
+        }
+
+
+def create_cache(backend="memory", ttl=3600, max_entries=256, path="llm_cache.db"):
+    if backend == "sqlite":
+        store = SQLiteStore(path, max_entries=max_entries)
+    else:
+        store = MemoryStore(max_entries=max_entries)
+    return ResponseCache(store, ttl=ttl)
@@ -0,0 +1,208 @@
+import logging
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("blog_generator")
+
+# Latency buckets in seconds; the top end covers the 600 s Bedrock read timeout
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, count, total) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((self.name + "_bucket", key + (("le", repr(float(bound))),), bucket_count))
+                samples.append((self.name + "_bucket", key + (("le", "+Inf"),), count))
+                samples.append((self.name + "_count", key, count))
+                samples.append((self.name + "_sum", key, total))
+        return samples
+
+
+# Metric whose values are read from a callback at scrape time
+class CallbackMetric:
+    def __init__(self, name, help_text, callback, kind="gauge"):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self):
+        return [(self.name, tuple(sorted(labels.items())), value) for labels, value in self.callback()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def callback(self, name, help_text, callback, kind="gauge"):
+        return self.register(CallbackMetric(name, help_text, callback, kind))
+
+    # Prometheus text exposition format
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_duration = registry.histogram("http_request_duration_seconds", "Time to produce a response, by route")
+dependency_duration = registry.histogram(
+    "dependency_duration_seconds", "Time spent in Bedrock, S3 and SQLite calls"
+)
+dependency_errors = registry.counter("dependency_errors_total", "Failed Bedrock and S3 calls")
+request_errors = registry.counter("http_request_errors_total", "Responses with a 5xx status, by route")
+bedrock_tokens = registry.counter("bedrock_tokens_total", "Bedrock tokens reported in the converse usage field")
+time_to_first_token = registry.histogram(
+    "bedrock_time_to_first_token_seconds", "Time from converse_stream call to the first text delta"
+)
+
+prompt_cache_tokens = registry.counter(
+    "bedrock_prompt_cache_tokens_total", "Input tokens read from or written to the Bedrock prompt cache, by template"
+)
+bedrock_limiter_wait = registry.histogram(
+    "bedrock_limiter_wait_seconds", "Time Bedrock calls waited for request and token quota"
+)
+bedrock_throttles = registry.counter("bedrock_throttles_total", "Bedrock calls rejected with ThrottlingException")
+bedrock_coalesced = registry.counter("bedrock_coalesced_total", "Bedrock calls that shared an identical in-flight request")
+
+
+def record_usage(model_id, usage, template="none"):
+    if not usage:
+        return
+    bedrock_tokens.inc(usage.get("inputTokens", 0), model=model_id, template=template, direction="input")
+    bedrock_tokens.inc(usage.get("outputTokens", 0), model=model_id, template=template, direction="output")
+    if "cacheReadInputTokens" in usage or "cacheWriteInputTokens" in usage:
+        prompt_cache_tokens.inc(usage.get("cacheReadInputTokens", 0), model=model_id, template=template, kind="read")
+        prompt_cache_tokens.inc(usage.get("cacheWriteInputTokens", 0), model=model_id, template=template, kind="write")
+
+
+# Time every call made through a boto3 client using botocore's event hooks
+def instrument_client(client, dependency):
+    def before_call(model, context, **kwargs):
+        context["metrics_start"] = time.perf_counter()
+        context["metrics_operation"] = model.name
+
+    def after_call(context, **kwargs):
+        start = context.get("metrics_start")
+        operation = context.get("metrics_operation", "unknown")
+        if start is not None:
+            dependency_duration.observe(time.perf_counter() - start, dependency=dependency, operation=operation)
+        parsed = kwargs.get("parsed") or {}
+        status = parsed.get("ResponseMetadata", {}).get("HTTPStatusCode", 200)
+        if status >= 400:
+            dependency_errors.inc(dependency=dependency, operation=operation)
+
+    # Connection failures and timeouts, where no response was parsed
+    def after_call_error(context, **kwargs):
+        dependency_errors.inc(dependency=dependency, operation=context.get("metrics_operation", "unknown"))
+
+    events = client.meta.events
+    events.register("before-call.*", before_call)
+    events.register("after-call.*", after_call)
+    events.register("after-call-error.*", after_call_error)
+    return client
+
+
+# sqlite3 connection that times each statement, labelled by its leading keyword
+class TimedConnection(sqlite3.Connection):
+    def execute(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            operation = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else "EMPTY"
+            dependency_duration.observe(time.perf_counter() - start, dependency="sqlite", operation=operation)
+
+
+# Log a sample of payloads, truncated, instead of dumping every request body
+class PayloadLogger:
+    def __init__(self, sample_rate=0.01, max_chars=500):
+        self.sample_rate = sample_rate
+        self.max_chars = max_chars
+
+    def __call__(self, label, payload):
+        if not logger.isEnabledFor(logging.DEBUG) and random.random() >= self.sample_rate:
+            return
+        text = repr(payload)
+        if len(text) > self.max_chars:
+            text = f"{text[:self.max_chars]}... ({len(text)} chars)"
+        logger.info("%s: %s", label, text)
@@ -0,0 +1,320 @@
+import gzip
+import hashlib
+import json
+import time
+import zlib
+
+import db
+from llm_cache import MemoryStore
+
+# A full snapshot is written once this many deltas have piled up since the last one
+COMPACT_EVERY = 50
+# Snapshots kept for revision history; older snapshots and deltas are pruned
+HISTORY_SNAPSHOTS = 5
+
+# Recently reconstructed pages, keyed by "<webpage_id>:<version>"
+reconstructed = MemoryStore(max_entries=64, max_bytes=64 * 1024 * 1024)
+
+
+class VersionConflict(Exception):
+    def __init__(self, current_version):
+        super().__init__(f"Webpage has changed; current version is {current_version}")
+        self.current_version = current_version
+
+
+class InvalidPatch(ValueError):
+    pass
+
+
+# Patches are lists of {"start", "end", "text"} operations against the base
+# version. Offsets count UTF-16 code units so they match JavaScript string indexes.
+def apply_patch(html, ops):
+    units = html.encode("utf-16-le")
+    pieces = []
+    position = 0
+    try:
+        for op in ops:
+            start, end, text = int(op["start"]), int(op["end"]), op.get("text", "")
+            if not isinstance(text, str) or start < position or end < start or end * 2 > len(units):
+                raise InvalidPatch("Patch operations must be ordered, non-overlapping and within the document")
+            pieces.append(units[position * 2:start * 2])
+            pieces.append(text.encode("utf-16-le"))
+            position = end
+    except (KeyError, TypeError, ValueError) as e:
+        raise InvalidPatch(str(e))
+    pieces.append(units[position * 2:])
+    try:
+        return b"".join(pieces).decode("utf-16-le")
+    except UnicodeDecodeError:
+        raise InvalidPatch("Patch splits a character")
+
+
+def common_prefix_length(a, b):
+    # Binary search over slice comparisons, which run in C
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def common_suffix_length(a, b, limit):
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:] == b[len(b) - middle:]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+# Single replace operation covering everything between the common prefix and suffix
+def diff_html(old, new):
+    if old == new:
+        return []
+    prefix = common_prefix_length(old, new)
+    suffix = common_suffix_length(old, new, min(len(old), len(new)) - prefix)
+    start = len(old[:prefix].encode("utf-16-le")) // 2
+    end = len(old[:len(old) - suffix].encode("utf-16-le")) // 2
+    return [{"start": start, "end": end, "text": new[prefix:len(new) - suffix]}]
+
+
+def compress(html):
+    return zlib.compress(html.encode("utf-8"), 6)
+
+
+def decompress(blob):
+    return zlib.decompress(blob).decode("utf-8")
+
+
+def content_hash(html):
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+
+# Validator for the get_webpage body. The body carries the version as well as the
+# HTML, so saving old content again must still change the tag.
+def page_etag(version, digest):
+    return f"{version}-{digest}"
+
+
+# JSON body served by get_webpage
+def response_body(html, version):
+    return json.dumps({"html_content": html, "version": version}).encode("utf-8")
+
+
+def get_page(conn, user_id, topic_id):
+    return conn.execute(
+        "SELECT id, version FROM webpages WHERE user_id = ? AND topic_id = ?", (user_id, topic_id)
+    ).fetchone()
+
+
+# Rebuild a version from the nearest snapshot at or below it plus the deltas after it
+def load_version(conn, webpage_id, version):
+    cache_key = f"{webpage_id}:{version}"
+    html = reconstructed.get(cache_key)
+    if html is not None:
+        return html
+    snapshot = conn.execute(
+        "SELECT version, html_z FROM webpage_snapshots WHERE webpage_id = ? AND version <= ? "
+        "ORDER BY version DESC LIMIT 1",
+        (webpage_id, version),
+    ).fetchone()
+    if snapshot is None:
+        return None
+    html = decompress(snapshot[1])
+    deltas = conn.execute(
+        "SELECT patch FROM webpage_deltas WHERE webpage_id = ? AND version > ? AND version <= ? ORDER BY version",
+        (webpage_id, snapshot[0], version),
+    ).fetchall()
+    for (patch,) in deltas:
+        html = apply_patch(html, json.loads(patch))
+    reconstructed.set(cache_key, html)
+    return html
+
+
+def load_html(user_id, topic_id, version=None):
+    # Read transaction so pruning by a concurrent save cannot interleave
+    with db.transaction() as conn:
+        page = get_page(conn, user_id, topic_id)
+        if not page or page[1] == 0:
+            return None, None
+        version = page[1] if version is None else int(version)
+        if version < 1 or version > page[1]:
+            return None, None
+        return load_version(conn, page[0], version), version
+
+
+# Version and content hash of the current page, without loading any content
+def current_hash(user_id, topic_id):
+    row = db.get_connection().execute(
+        "SELECT version, content_hash FROM webpages WHERE user_id = ? AND topic_id = ? AND version > 0",
+        (user_id, topic_id),
+    ).fetchone()
+    return (row[0], row[1]) if row else (None, None)
+
+
+# Gzipped get_webpage body for the current version, built once per version and
+# stored on the row so repeat loads skip reconstruction and compression
+def compressed_page(user_id, topic_id):
+    with db.transaction() as conn:
+        row = conn.execute(
+            "SELECT id, version, content_hash, body_gz FROM webpages WHERE user_id = ? AND topic_id = ? AND version > 0",
+            (user_id, topic_id),
+        ).fetchone()
+        if not row:
+            return None
+        webpage_id, version, digest, body_gz = row
+        if body_gz is not None and digest is not None:
+            return {"version": version, "content_hash": digest, "body_gz": body_gz}
+        html = load_version(conn, webpage_id, version)
+    digest = content_hash(html)
+    body_gz = gzip.compress(response_body(html, version), 6)
+    # Skip the write if a save has moved the page on in the meantime
+    db.try_execute(
+        "UPDATE webpages SET content_hash = ?, body_gz = ? WHERE id = ? AND version = ?",
+        (digest, body_gz, webpage_id, version),
+    )
+    return {"version": version, "content_hash": digest, "body_gz": body_gz}
+
+
+def write_version(conn, webpage_id, version, old_html, new_html, patch=None):
+    now = time.time()
+    last_snapshot = conn.execute(
+        "SELECT MAX(version) FROM webpage_snapshots WHERE webpage_id = ?", (webpage_id,)
+    ).fetchone()[0] or 0
+    if old_html is None or version - last_snapshot >= COMPACT_EVERY:
+        conn.execute(
+            "INSERT INTO webpage_snapshots (webpage_id, version, html_z, created_at) VALUES (?, ?, ?, ?)",
+            (webpage_id, version, compress(new_html), now),
+        )
+        prune_history(conn, webpage_id)
+    else:
+        if patch is None:
+            patch = diff_html(old_html, new_html)
+        conn.execute(
+            "INSERT INTO webpage_deltas (webpage_id, version, patch, created_at) VALUES (?, ?, ?, ?)",
+            (webpage_id, version, json.dumps(patch), now),
+        )
+    # The compressed response body is rebuilt on the next read
+    conn.execute(
+        "UPDATE webpages SET version = ?, content_hash = ?, body_gz = NULL WHERE id = ?",
+        (version, content_hash(new_html), webpage_id),
+    )
+
+
+def prune_history(conn, webpage_id):
+    oldest_kept = conn.execute(
+        "SELECT version FROM webpage_snapshots WHERE webpage_id = ? ORDER BY version DESC LIMIT 1 OFFSET ?",
+        (webpage_id, HISTORY_SNAPSHOTS - 1),
+    ).fetchone()
+    if oldest_kept:
+        conn.execute("DELETE FROM webpage_snapshots WHERE webpage_id = ? AND version < ?", (webpage_id, oldest_kept[0]))
+        conn.execute("DELETE FROM webpage_deltas WHERE webpage_id = ? AND version <= ?", (webpage_id, oldest_kept[0]))
+
+
+# Save either a full document or a patch against base_version. When base_version
+# is given and is not the current version the save is rejected with VersionConflict.
+def save(user_id, topic_id, html_content=None, patch=None, base_version=None):
+    with db.transaction(immediate=True) as conn:
+        page = get_page(conn, user_id, topic_id)
+        if page is None:
+            cursor = conn.execute(
+                "INSERT INTO webpages (user_id, topic_id, html_content, version) VALUES (?, ?, '', 0)",
+                (user_id, topic_id),
+            )
+            page = (cursor.lastrowid, 0)
+        webpage_id, current = page
+        if base_version is not None and int(base_version) != current:
+            raise VersionConflict(current)
+        old_html = load_version(conn, webpage_id, current) if current else None
+        if patch is not None:
+            if old_html is None:
+                raise VersionConflict(current)
+            new_html = apply_patch(old_html, patch)
+        else:
+            new_html = html_content
+        if new_html == old_html:
+            return current
+        write_version(conn, webpage_id, current + 1, old_html, new_html, patch)
+    # Only cache once the new version is committed
+    reconstructed.set(f"{webpage_id}:{current + 1}", new_html)
+    return current + 1
+
+
+def history(user_id, topic_id):
+    conn = db.get_connection()
+    page = get_page(conn, user_id, topic_id)
+    if not page:
+        return []
+    rows = conn.execute(
+        "SELECT version, created_at, 'snapshot' FROM webpage_snapshots WHERE webpage_id = ? "
+        "UNION ALL SELECT version, created_at, 'delta' FROM webpage_deltas WHERE webpage_id = ? "
+        "ORDER BY version DESC",
+        (page[0], page[0]),
+    ).fetchall()
+    return [{"version": row[0], "saved_at": row[1], "kind": row[2]} for row in rows]
+
+
+def init_db():
+    with db.transaction(immediate=True) as conn:
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(webpages)")]
+        if "version" not in columns:
+            conn.execute("ALTER TABLE webpages ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        if "content_hash" not in columns:
+            conn.execute("ALTER TABLE webpages ADD COLUMN content_hash TEXT")
+        if "body_gz" not in columns:
+            conn.execute("ALTER TABLE webpages ADD COLUMN body_gz BLOB")
+
+        # Compressed full copies of a page
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS webpage_snapshots (
+            webpage_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            html_z BLOB NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (webpage_id, version),
+            FOREIGN KEY (webpage_id) REFERENCES webpages(id)
+        )''')
+
+        # One patch per saved version between snapshots
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS webpage_deltas (
+            webpage_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            patch TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (webpage_id, version),
+            FOREIGN KEY (webpage_id) REFERENCES webpages(id)
+        )''')
+
+        migrated = migrate_legacy_pages(conn)
+        fill_content_hashes(conn)
+
+    # Reclaim the space freed by moving html_content out of webpages
+    if migrated:
+        db.get_connection().execute("VACUUM")
+
+
+# Move pages saved before versioning into a first snapshot
+def migrate_legacy_pages(conn):
+    rows = conn.execute("SELECT id, html_content FROM webpages WHERE version = 0 AND html_content != ''").fetchall()
+    for webpage_id, html in rows:
+        conn.execute(
+            "INSERT INTO webpage_snapshots (webpage_id, version, html_z, created_at) VALUES (?, 1, ?, ?)",
+            (webpage_id, compress(html), time.time()),
+        )
+        conn.execute("UPDATE webpages SET version = 1, html_content = '' WHERE id = ?", (webpage_id,))
+    return len(rows)
+
+
+# Store content hashes for pages saved before they were recorded
+def fill_content_hashes(conn):
+    rows = conn.execute("SELECT id, version FROM webpages WHERE version > 0 AND content_hash IS NULL").fetchall()
+    for webpage_id, version in rows:
+        html = load_version(conn, webpage_id, version)
+        if html is not None:
+            conn.execute("UPDATE webpages SET content_hash = ? WHERE id = ?", (content_hash(html), webpage_id))
@@ -0,0 +1,102 @@
+import string
+
+# Bedrock prompt-cache checkpoint: the system text before it is cached between calls
+# and billed at the cache-read rate. Bedrock ignores checkpoints after prefixes shorter
+# than the model's minimum (1024 tokens for Claude 3.7 Sonnet), so templates only get
+# one when their system text is long enough.
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+MIN_CACHE_TOKENS = 1024
+
+LENGTH_RULE = "Try generate the content or code within 4500 tokens."
+
+
+# A template rendered for one call: the shared system blocks and the user message
+class RenderedPrompt:
+    def __init__(self, template, text):
+        self.template = template
+        self.system = template.system_blocks
+        self.messages = [{"role": "user", "content": [{"text": text}]}]
+
+    @property
+    def name(self):
+        return self.template.label
+
+
+# A named, versioned prompt: a static system prefix and a user message with
+# {placeholders}. The system blocks are built once and shared by every render.
+class PromptTemplate:
+    def __init__(self, name, version, system, user):
+        self.name = name
+        self.version = version
+        self.label = f"{name}@v{version}"
+        self.user = user
+        self.fields = {field for _, field, _, _ in string.Formatter().parse(user) if field}
+        self.system_blocks = [{"text": system}]
+        # Same 4 characters per token estimate as bedrock.estimate_tokens
+        if len(system) // 4 >= MIN_CACHE_TOKENS:
+            self.system_blocks.append(CACHE_POINT)
+
+    def render(self, **params):
+        missing = self.fields - params.keys()
+        if missing:
+            raise KeyError(f"Prompt {self.label} is missing {', '.join(sorted(missing))}")
+        return RenderedPrompt(self, self.user.format_map(params))
+
+
+class PromptRegistry:
+    def __init__(self):
+        self._templates = {}
+
+    def register(self, name, version, system, user):
+        template = PromptTemplate(name, version, system, user)
+        self._templates.setdefault(name, {})[version] = template
+        return template
+
+    # Latest version unless one is pinned
+    def get(self, name, version=None):
+        versions = self._templates[name]
+        return versions[version if version is not None else max(versions)]
+
+    def render(self, name, version=None, **params):
+        return self.get(name, version).render(**params)
+
+
+registry = PromptRegistry()
+
+registry.register(
+    "generate", 1,
+    system=(
+        "You are a content generation/modification bot. "
+        "Generate new content if no original content is provided, or modify the provided content based on the prompt. "
+        "Output only the modified or generated content. " + LENGTH_RULE
+    ),
+    user="Original content: {content}\nPrompt: {prompt}",
+)
+
+registry.register(
+    "generate_section", 1,
+    system=(
+        "You are a content modification bot. You are given one section of a longer HTML or markdown document. "
+        "Modify this section according to the prompt, keeping its markup structure. If the prompt does not apply "
+        "to this section, return it unchanged. Output only the section. " + LENGTH_RULE
+    ),
+    user="Section heading: {heading}\nSection: {section}\nPrompt: {prompt}",
+)
+
+registry.register(
+    "blog_template", 1,
+    system="""Generate a professional blog webpage template using only HTML and CSS.
+Design requirements:
+- Clean typography with proper spacing and line height for readability.
+- Proper visual hierarchy to guide readers through the content.
+- Should be a visually appealing webpage.
+- Do not include any hyperlinks unless I explicitly mention them in the input.
+- Do NOT include any of the following unless I specifically mention them in my input:
+    Hyperlinks (i.e., <a href="..."> tags)
+    Text links
+    Buttons that link to other pages (e.g., CTA buttons with links or navigation)
+    This blog is meant to be self-contained. Use only plain text and images. No external references, links, or navigation elements unless requested.
+IMPORTANT: Your response should ONLY contain the complete HTML and CSS code i.e the response generated should start with <html> and end with </html>. Any explanations, descriptions, or additional information must be ignored included as HTML comments using the format: <!-- Additional information from the model: explanation here -->
+""" + LENGTH_RULE,
+    user="Webpage request: {additional_prompt}",
+)
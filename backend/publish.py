@@ -0,0 +1,128 @@
+import gzip
+import hashlib
+import json
+import time
+
+from botocore.exceptions import ClientError
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+PAGE_CACHE_CONTROL = "public, max-age=300, must-revalidate"
+MANIFEST_CACHE_CONTROL = "no-cache"
+
+
+def page_key(user_id, topic_id):
+    return f"webpages/{user_id}_{topic_id}.html"
+
+
+def manifest_key(user_id):
+    return f"webpages/{user_id}_manifest.json"
+
+
+# S3 does not negotiate encodings, so every reader gets the stored one. gzip is
+# accepted by every browser; br is only safe when all readers use HTTPS.
+def encode_page(html, encoding="gzip"):
+    data = html.encode("utf-8")
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(data, quality=11), "br"
+    return gzip.compress(data, 9, mtime=0), "gzip"
+
+
+def load_manifest(s3, bucket, user_id):
+    try:
+        response = s3.get_object(Bucket=bucket, Key=manifest_key(user_id))
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return {"pages": {}}
+        raise
+    return json.loads(response["Body"].read())
+
+
+# Hash recorded on an object we uploaded earlier, for pages missing from the manifest
+def published_hash(s3, bucket, key):
+    try:
+        response = s3.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+    return response.get("Metadata", {}).get("content-sha256")
+
+
+def upload_page(s3, bucket, key, html, digest, encoding):
+    body, content_encoding = encode_page(html, encoding)
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=body,
+        ContentType="text/html; charset=utf-8",
+        ContentEncoding=content_encoding,
+        CacheControl=PAGE_CACHE_CONTROL,
+        Metadata={"content-sha256": digest},
+    )
+    return len(body)
+
+
+def check_and_upload(s3, bucket, key, html, digest, encoding, manifest_hash, force, transform=None):
+    if not force and manifest_hash is None and published_hash(s3, bucket, key) == digest:
+        return None
+    if transform is not None:
+        html = transform(html)
+    return upload_page(s3, bucket, key, html, digest, encoding)
+
+
+# Hash of a saved page as it will be published; a transform's version is included so
+# pages are republished when the transform changes
+def page_digest(html, transform=None):
+    version = getattr(transform, "version", "")
+    data = f"{version}\0{html}" if version else html
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+# Publish {topic_id: html} for one user. Pages whose hash matches the manifest (or the
+# object metadata) are skipped; the rest are transformed, uploaded in parallel and the
+# manifest rewritten.
+def publish_pages(s3, bucket, executor, user_id, pages, encoding="gzip", force=False, transform=None):
+    manifest = load_manifest(s3, bucket, user_id)
+    entries = manifest.setdefault("pages", {})
+    results = {}
+    futures = {}
+    for topic_id, html in pages.items():
+        topic_id = str(topic_id)
+        key = page_key(user_id, topic_id)
+        digest = page_digest(html, transform)
+        manifest_hash = entries.get(topic_id, {}).get("sha256")
+        if not force and manifest_hash == digest:
+            results[topic_id] = {"key": key, "status": "unchanged"}
+            continue
+        future = executor.submit(
+            check_and_upload, s3, bucket, key, html, digest, encoding, manifest_hash, force, transform
+        )
+        futures[future] = (topic_id, key, digest)
+
+    changed = False
+    for future, (topic_id, key, digest) in futures.items():
+        try:
+            size = future.result()
+        except Exception as e:
+            results[topic_id] = {"key": key, "status": "failed", "error": str(e)}
+            continue
+        entries[topic_id] = {"key": key, "sha256": digest, "published_at": time.time()}
+        changed = True
+        if size is None:
+            results[topic_id] = {"key": key, "status": "unchanged"}
+        else:
+            results[topic_id] = {"key": key, "status": "uploaded", "bytes": size}
+
+    if changed:
+        s3.put_object(
+            Bucket=bucket,
+            Key=manifest_key(user_id),
+            Body=json.dumps(manifest).encode("utf-8"),
+            ContentType="application/json",
+            CacheControl=MANIFEST_CACHE_CONTROL,
+        )
+    return results
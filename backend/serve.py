@@ -0,0 +1,82 @@
+"""Production launcher for the API.
+
+    python serve.py                              # ASGI on uvicorn, 2 worker processes
+    python serve.py --mode wsgi --workers 4      # Flask on gunicorn threads
+    WEB_WORKERS=8 PORT=8000 python serve.py
+
+ASGI mode (asgi.py) needs starlette and uvicorn; WSGI mode needs gunicorn. Each
+worker process runs its own job workers and in-memory response cache; use
+LLM_CACHE_BACKEND=sqlite to share cached responses between workers.
+"""
+import argparse
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def asgi_available():
+    try:
+        import starlette  # noqa: F401
+        import uvicorn  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def run_asgi(args):
+    import uvicorn
+
+    uvicorn.run(
+        "asgi:app",
+        app_dir=BACKEND_DIR,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_keep_alive=75,
+        log_level=os.environ.get("LOG_LEVEL", "info").lower(),
+    )
+
+
+def run_wsgi(args):
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{args.host}:{args.port}")
+            self.cfg.set("workers", args.workers)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("threads", args.threads)
+            # Above the 600 s Bedrock read timeout so long generations are not killed
+            self.cfg.set("timeout", 660)
+
+        # Imported in each worker after the fork, so every process starts its own job workers
+        def load(self):
+            sys.path.insert(0, BACKEND_DIR)
+            from app import app
+            return app
+
+    Server().run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("asgi", "wsgi"), default=os.environ.get("SERVER_MODE"),
+                        help="server type (default: asgi when starlette and uvicorn are installed)")
+    parser.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "5000")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_WORKERS", "2")),
+                        help="worker processes")
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("WEB_THREADS", "32")),
+                        help="threads per worker in wsgi mode")
+    args = parser.parse_args(argv)
+
+    mode = args.mode or ("asgi" if asgi_available() else "wsgi")
+    if mode == "asgi":
+        run_asgi(args)
+    else:
+        run_wsgi(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app reads these at import time: a throwaway database and the in-process fake AWS clients
+os.environ["BLOG_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="blog-tests-"), "blog_content.db")
+os.environ["BLOG_FAKE_AWS"] = "1"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jwt  # noqa: E402
+
+import app as blog_app  # noqa: E402
+
+topic_ids = itertools.count(1)
+
+
+@pytest.fixture
+def client():
+    return blog_app.app.test_client()
+
+
+@pytest.fixture
+def auth_headers():
+    token = jwt.encode({"user_id": 1}, blog_app.SECRET_KEY, algorithm="HS256")
+    return {"Authorization": f"Bearer {token}"}
+
+
+# Every test gets a page of its own in the shared database
+@pytest.fixture
+def topic_id():
+    return next(topic_ids)
@@ -0,0 +1,86 @@
+import json
+import threading
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+
+import bedrock
+from fakes import FakeBedrockClient
+
+
+class FailingClient:
+    meta = None
+
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    def converse(self, **kwargs):
+        self.calls += 1
+        raise self.error
+
+
+def converse_kwargs(text="hi"):
+    return {"modelId": "test-model", "messages": [{"role": "user", "content": [{"text": text}]}]}
+
+
+def test_token_bucket_reserves_and_reports_the_wait():
+    bucket = bedrock.TokenBucket(60)
+    assert bucket.try_take(60) == 0
+    wait = bucket.try_take(1)
+    assert 0 < wait <= 1.0
+    bucket.give_back(1)
+    assert bucket.try_take(1) == 0
+
+
+def test_limiter_raises_throttled_past_the_deadline():
+    limiter = bedrock.ModelLimiter(rpm=1)
+    limiter.acquire(0, max_wait=0)
+    with pytest.raises(bedrock.ThrottledError) as raised:
+        limiter.acquire(0, max_wait=0)
+    assert raised.value.retry_after >= 1
+
+
+@pytest.mark.parametrize("error", [
+    ReadTimeoutError(endpoint_url="https://bedrock"),
+    ClientError({"Error": {"Code": "ModelTimeoutException", "Message": "slow"}}, "Converse"),
+])
+def test_timeouts_are_not_retried(error):
+    client = FailingClient(error)
+    with pytest.raises(bedrock.TimedOutError):
+        bedrock.AdaptiveClient(client, max_retries=3, base_delay=0).converse(**converse_kwargs())
+    assert client.calls == 1
+
+
+@pytest.mark.parametrize("error, expected", [
+    (EndpointConnectionError(endpoint_url="https://bedrock"), bedrock.UnavailableError),
+    (ClientError({"Error": {"Code": "ThrottlingException", "Message": "slow down"}}, "Converse"),
+     bedrock.ThrottledError),
+])
+def test_transient_errors_are_retried(error, expected):
+    client = FailingClient(error)
+    with pytest.raises(expected):
+        bedrock.AdaptiveClient(client, max_retries=2, base_delay=0).converse(**converse_kwargs())
+    assert client.calls == 3
+
+
+def test_validation_errors_fail_fast():
+    client = FailingClient(ClientError({"Error": {"Code": "ValidationException", "Message": "bad"}}, "Converse"))
+    with pytest.raises(bedrock.InvalidRequestError):
+        bedrock.AdaptiveClient(client, max_retries=2, base_delay=0).converse(**converse_kwargs())
+    assert client.calls == 1
+
+
+def test_coalesced_calls_share_one_request_and_its_usage():
+    fake = FakeBedrockClient(first_token_latency=0.2, tokens_per_second=1e6, output_tokens=10)
+    client = bedrock.AdaptiveClient(fake)
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(client.converse(**converse_kwargs())))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert fake.calls == 1
+    assert sum("usage" in response for response in responses) == 1
+    assert len({json.dumps(response["output"]) for response in responses}) == 1
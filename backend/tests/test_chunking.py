@@ -0,0 +1,132 @@
+import pytest
+
+import chunking
+
+PAGE = (
+    "<html><head><style>h2 { color: red }</style></head><body><main><article><h1>Trip</h1><p>Intro</p>"
+    + "".join(f"<section><h2>{name}</h2><p>About {name.lower()}</p></section>" for name in
+              ["Planning", "Budget", "Food", "Hotels", "Transport", "Summary"])
+    + "<p>Outro</p></article></main></body></html>"
+)
+
+
+def sections_of(text):
+    head, sections, tail = chunking.split_document(text)
+    assert head + "".join(s["text"] for s in sections) + tail == text
+    return head, sections, tail
+
+
+def test_sections_are_balanced_sibling_blocks():
+    head, sections, tail = sections_of(PAGE)
+    assert [s["heading"] for s in sections] == ["Trip", "Planning", "Budget", "Food", "Hotels", "Transport", "Summary"]
+    assert head.endswith("<article>")
+    assert sections[0]["text"] == "<h1>Trip</h1><p>Intro</p>"
+    assert tail == "</article></main></body></html>"
+    for section in sections[1:]:
+        assert section["text"].startswith("<section>")
+        assert section["text"].count("<section>") == section["text"].count("</section>") == 1
+    assert sections[-1]["text"].endswith("</section><p>Outro</p>")
+
+
+def test_headings_split_when_there_are_no_section_blocks():
+    _, sections, _ = sections_of("<div><h2>One</h2><p>x<h2>Two</h2><ul><li>a<li>b</ul><h3>Three</h3></div>")
+    assert [s["heading"] for s in sections] == ["One", "Two", "Three"]
+
+
+def test_markup_inside_scripts_is_not_a_boundary():
+    text = "<body><script>s = '<section>'</script><section>a</section><section>b</section></body>"
+    head, sections, _ = sections_of(text)
+    assert "<script>" in head
+    assert [s["text"] for s in sections] == ["<section>a</section>", "<section>b</section>"]
+
+
+def test_markdown_splits_on_headings():
+    _, sections, _ = sections_of("# Title\nintro\n## One\nx\n## Two\ny\n")
+    assert [s["heading"] for s in sections] == ["Title", "One", "Two"]
+
+
+def test_visible_text_before_the_first_heading_is_an_intro_section():
+    head, sections, tail = sections_of("<body><p>Intro</p><h2>A</h2><p>a</p><h2>B</h2><p>b</p></body>")
+    assert (head, tail) == ("<body>", "</body>")
+    assert [s["text"] for s in sections] == ["<p>Intro</p>", "<h2>A</h2><p>a</p>", "<h2>B</h2><p>b</p>"]
+    _, sections, _ = sections_of("preamble\n# A\nx\n# B\ny")
+    assert [s["heading"] for s in sections] == ["", "A", "B"]
+
+
+def test_single_block_is_one_section():
+    head, sections, tail = sections_of("<p>just one</p>")
+    assert (head, tail, len(sections)) == ("", "", 1)
+
+
+def test_select_by_number_heading_and_global_prompts():
+    _, sections, _ = sections_of(PAGE)
+    assert chunking.select_sections(sections, "expand section 2") == [1]
+    assert chunking.select_sections(sections, "shorten part 3") == [2]
+    assert chunking.select_sections(sections, "make the budget friendlier") == [2]
+    assert chunking.select_sections(sections, "translate to French") == []
+    assert chunking.select_sections(sections, "anything", section_ids=[0, 5]) == [0, 5]
+
+
+@pytest.mark.parametrize("prompt, section_ids", [
+    ("rewrite section 9", None),
+    ("shorten part 0", None),
+    ("anything", [1, 7]),
+])
+def test_unknown_sections_are_rejected(prompt, section_ids):
+    _, sections, _ = sections_of(PAGE)
+    with pytest.raises(chunking.SectionNotFound):
+        chunking.select_sections(sections, prompt, section_ids)
+
+
+def test_stitch_replaces_only_edited_sections():
+    head, sections, tail = sections_of(PAGE)
+    result = chunking.stitch(head, sections, {1: "<section>new</section>"}, tail)
+    assert result == PAGE.replace(sections[1]["text"], "<section>new</section>")
+
+
+@pytest.mark.parametrize("prompt, expected", [
+    ("make the headings blue", False),
+    ("change the background colour", True),
+    ("use a serif font", True),
+    ("update the CSS", True),
+    ("rewrite the heading of the budget section", False),
+])
+def test_style_prompts_need_the_whole_document(prompt, expected):
+    assert chunking.targets_document(prompt) is expected
+
+
+def test_generate_rejects_unknown_section(client, auth_headers):
+    body = {"content": PAGE, "prompt": "rewrite section 9", "sections": True}
+    response = client.post("/api/generate", json=body, headers=auth_headers)
+    assert response.status_code == 400
+
+
+def test_section_ids_turn_on_section_mode_for_short_pages():
+    import app
+
+    options = app.parse_generate_request({"content": "<h2>A</h2><p>a</p><h2>B</h2><p>b</p>", "section_ids": [1]}, {})
+    assert options["plan"] is not None
+    assert options["plan"][3] == {1}
+
+
+@pytest.mark.parametrize("data", [
+    {"content": "", "section_ids": [0]},
+    {"content": "<h2>A</h2><h2>B</h2>", "section_ids": [0], "sections": False},
+])
+def test_section_ids_without_section_mode_are_rejected(data):
+    import app
+
+    with pytest.raises(app.RequestError):
+        app.parse_generate_request(data, {})
+
+
+def test_global_prompts_edit_the_whole_document_when_text_is_outside_the_sections():
+    import app
+
+    page = "<body><header>Site</header><main><section>a</section><section>b</section></main><footer>f</footer></body>"
+    options = app.parse_generate_request({"content": page, "prompt": "translate to French", "sections": True}, {})
+    assert options["plan"] is None
+    assert options["claude_prompt"] is not None
+    assert not options["job_payload"]["sections"]
+    options = app.parse_generate_request({"content": page, "prompt": "rewrite section 2", "sections": True}, {})
+    assert options["plan"][3] == {1}
@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+PROMPT = SimpleNamespace(name="test", system=[{"text": "system"}], messages=[{"role": "user", "content": [{"text": "hi"}]}])
+
+
+# Replies in scripted chunks; every call but the last stops at max_tokens
+class ScriptedClient:
+    def __init__(self, calls):
+        self.calls = calls
+        self.requests = []
+
+    def _next(self, kwargs):
+        self.requests.append(kwargs)
+        chunks = self.calls[len(self.requests) - 1]
+        return chunks, "max_tokens" if len(self.requests) < len(self.calls) else "end_turn"
+
+    def converse(self, **kwargs):
+        chunks, stop_reason = self._next(kwargs)
+        return {"output": {"message": {"content": [{"text": "".join(chunks)}]}}, "stopReason": stop_reason, "usage": {}}
+
+    def converse_stream(self, **kwargs):
+        chunks, stop_reason = self._next(kwargs)
+        events = [{"contentBlockDelta": {"delta": {"text": chunk}}} for chunk in chunks]
+        return {"stream": events + [{"messageStop": {"stopReason": stop_reason}}]}
+
+
+@pytest.mark.parametrize("calls", [
+    [["Hello", " wor", "ld  \n"], [" more", " text\n"]],
+    [["Hello ", " "], ["\n", "world"]],
+    [["one"], ["two "]],
+])
+def test_streamed_continuations_match_the_blocking_reply(monkeypatch, calls):
+    blocking = ScriptedClient(calls)
+    monkeypatch.setattr(app, "client", blocking)
+    expected = app.invoke_claude(PROMPT, use_cache=False)
+
+    streaming = ScriptedClient(calls)
+    monkeypatch.setattr(app, "client", streaming)
+    assert "".join(app.invoke_claude_stream(PROMPT, use_cache=False)) == expected
+    assert streaming.requests == blocking.requests
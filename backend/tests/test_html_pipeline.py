@@ -0,0 +1,55 @@
+import pytest
+
+import html_pipeline
+from html_pipeline import transform_html
+
+
+def test_whitespace_between_blocks_is_dropped():
+    assert transform_html("<div>\n  <p> a   b </p>\n</div>\n") == "<div><p>a b</p></div>"
+
+
+@pytest.mark.parametrize("html", [
+    "<p>Click <svg></svg> here and <iframe src=\"x\"></iframe> now</p>",
+    "<p>Watch <video src=\"v.mp4\"></video> or <audio src=\"a.mp3\"></audio> then</p>",
+    "<p>See <picture><source srcset=\"a.webp\"><img src=\"a.png\"></picture> above</p>",
+    "<p>A <b>bold</b> <i>move</i></p>",
+])
+def test_spaces_next_to_inline_elements_are_kept(html):
+    assert transform_html(html) == html.replace("<img src=\"a.png\">", "<img src=\"a.png\" decoding=\"async\">")
+
+
+def test_hidden_elements_leave_whitespace_to_their_neighbours():
+    html = "<html>\n<head>\n<title>Page</title>\n<meta charset=utf-8>\n</head>\n<body><p>a <script>x = 1</script> b</p></body></html>"
+    assert transform_html(html) == (
+        "<html><head><title>Page</title><meta charset=utf-8></head><body><p>a<script>x = 1</script> b</p></body></html>"
+    )
+
+
+def test_style_is_minified_across_chunks():
+    transformer = html_pipeline.HtmlTransformer()
+    out = transformer.feed("<style> body {\n color: red") + transformer.feed("; }\n</style>") + transformer.close()
+    assert out == "<style>body{color:red}</style>"
+
+
+@pytest.mark.parametrize("html, expected", [
+    ("<html><head><style>body { color: red }", "<html><head><style>body{color:red}"),
+    ("<p>x<script>a < b", "<p>x<script>a < b"),
+])
+def test_unterminated_style_and_script_are_kept(html, expected):
+    assert transform_html(html) == expected
+
+
+def test_images_are_lazy_after_the_first_and_get_known_sizes():
+    info = {"width": 800, "height": 600, "srcset": "a-400.png 400w, a.png 800w"}
+    out = transform_html("<img src=\"a.png\"><img src=\"b.png\">", lambda src: info if src == "a.png" else None)
+    assert out == (
+        "<img src=\"a.png\" decoding=\"async\" width=\"800\" height=\"600\" srcset=\"a-400.png 400w, a.png 800w\""
+        " sizes=\"(max-width: 800px) 100vw, 800px\"><img src=\"b.png\" loading=\"lazy\" decoding=\"async\">"
+    )
+
+
+def test_pipeline_caches_by_input():
+    calls = []
+    pipeline = html_pipeline.HtmlPipeline(image_info=lambda src: calls.append(src))
+    assert pipeline("<p><img src=\"a.png\"></p>") == pipeline("<p><img src=\"a.png\"></p>")
+    assert calls == ["a.png"]
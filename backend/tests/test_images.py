@@ -0,0 +1,32 @@
+import io
+import json
+
+import pytest
+
+import bedrock
+import images
+
+
+class ImageClient:
+    def __init__(self, returned):
+        self.returned = returned
+        self.calls = 0
+
+    def invoke_model(self, **kwargs):
+        self.calls += 1
+        return {"body": io.BytesIO(json.dumps({"images": ["aGk="] * self.returned}).encode())}
+
+
+def test_short_image_batches_raise_after_one_call():
+    client = ImageClient(returned=1)
+    with pytest.raises(bedrock.BedrockError):
+        images.generate_image_bytes(client, "image-model", "a cat", count=3)
+    assert client.calls == 1
+    assert images.generate_image_bytes(ImageClient(returned=2), "image-model", "a cat", count=2) == [b"hi", b"hi"]
+
+
+@pytest.mark.parametrize("route", ["/api/generate_image", "/api/generate_images"])
+@pytest.mark.parametrize("prompt", [["a", "b"], 5, {"text": "a"}, "   "])
+def test_prompt_must_be_a_non_empty_string(client, auth_headers, route, prompt):
+    response = client.post(route, json={"prompt": prompt}, headers=auth_headers)
+    assert response.status_code == 400
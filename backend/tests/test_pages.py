@@ -0,0 +1,147 @@
+import gzip
+import json
+
+import pytest
+
+import db
+import pages
+
+
+def save(client, headers, topic_id, **body):
+    return client.post("/api/save_webpage", json={"user_id": 1, "topic_id": topic_id, **body}, headers=headers)
+
+
+def get(client, headers, topic_id, etag=None):
+    if etag:
+        headers = {**headers, "If-None-Match": etag}
+    return client.get(f"/api/get_webpage?user_id=1&topic_id={topic_id}", headers=headers)
+
+
+@pytest.mark.parametrize("old, new", [
+    ("<p>hello</p>", "<p>hello world</p>"),
+    ("<p>hello world</p>", "<p>world</p>"),
+    ("", "<p>new</p>"),
+    ("<p>same</p>", "<p>same</p>"),
+    ("<p>😀 smile</p>", "<p>😀😀 smile</p>"),
+    ("<p>a😀b</p>", "<p>a😁b</p>"),
+    ("<p>𝒜 then text</p>", "<p>𝒜 then more text</p>"),
+])
+def test_diff_and_apply_patch_round_trip(old, new):
+    assert pages.apply_patch(old, pages.diff_html(old, new)) == new
+
+
+def test_patch_offsets_count_utf16_code_units():
+    # "😀" is two UTF-16 code units, as in JavaScript's "😀".length
+    html = "<p>😀x</p>"
+    assert pages.apply_patch(html, [{"start": 5, "end": 6, "text": "y"}]) == "<p>😀y</p>"
+    assert pages.diff_html(html, "<p>😀y</p>") == [{"start": 5, "end": 6, "text": "y"}]
+
+
+def test_patch_splitting_a_surrogate_pair_is_rejected():
+    with pytest.raises(pages.InvalidPatch):
+        pages.apply_patch("<p>😀</p>", [{"start": 4, "end": 5, "text": ""}])
+
+
+@pytest.mark.parametrize("ops", [
+    [{"start": 5, "end": 2, "text": ""}],
+    [{"start": 0, "end": 99, "text": ""}],
+    [{"start": 4, "end": 5, "text": "a"}, {"start": 1, "end": 2, "text": "b"}],
+    [{"end": 1}],
+    [{"start": 0, "end": 1, "text": 5}],
+])
+def test_invalid_patches_are_rejected(ops):
+    with pytest.raises(pages.InvalidPatch):
+        pages.apply_patch("<p>hi</p>", ops)
+
+
+def test_save_patch_and_read_back(client, auth_headers, topic_id):
+    assert save(client, auth_headers, topic_id, html_content="<p>😀 one</p>").get_json()["version"] == 1
+    patch = pages.diff_html("<p>😀 one</p>", "<p>😀 two</p>")
+    response = save(client, auth_headers, topic_id, patch=patch, base_version=1)
+    assert response.status_code == 200
+    assert response.get_json()["version"] == 2
+    assert get(client, auth_headers, topic_id).get_json() == {"html_content": "<p>😀 two</p>", "version": 2}
+
+
+def test_stale_base_version_is_a_conflict(client, auth_headers, topic_id):
+    save(client, auth_headers, topic_id, html_content="<p>one</p>")
+    save(client, auth_headers, topic_id, html_content="<p>two</p>")
+    response = save(client, auth_headers, topic_id, patch=[{"start": 0, "end": 0, "text": "x"}], base_version=1)
+    assert response.status_code == 409
+    assert response.get_json()["version"] == 2
+    response = save(client, auth_headers, topic_id, html_content="<p>three</p>", base_version=1)
+    assert response.status_code == 409
+    assert get(client, auth_headers, topic_id).get_json()["html_content"] == "<p>two</p>"
+
+
+def test_patch_without_base_version_is_rejected(client, auth_headers, topic_id):
+    save(client, auth_headers, topic_id, html_content="<p>one</p>")
+    assert save(client, auth_headers, topic_id, patch=[]).status_code == 400
+
+
+def test_bad_patch_is_a_bad_request(client, auth_headers, topic_id):
+    save(client, auth_headers, topic_id, html_content="<p>one</p>")
+    response = save(client, auth_headers, topic_id, patch=[{"start": 0, "end": 999, "text": ""}], base_version=1)
+    assert response.status_code == 400
+
+
+def test_unchanged_save_keeps_the_version(client, auth_headers, topic_id):
+    save(client, auth_headers, topic_id, html_content="<p>one</p>")
+    assert save(client, auth_headers, topic_id, html_content="<p>one</p>").get_json()["version"] == 1
+
+
+def test_etag_revalidation(client, auth_headers, topic_id):
+    save(client, auth_headers, topic_id, html_content="<p>one</p>")
+    first = get(client, auth_headers, topic_id)
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"1-')
+    assert get(client, auth_headers, topic_id, etag).status_code == 304
+
+    save(client, auth_headers, topic_id, html_content="<p>two</p>")
+    response = get(client, auth_headers, topic_id, etag)
+    assert response.status_code == 200
+    assert response.get_json() == {"html_content": "<p>two</p>", "version": 2}
+
+
+def test_etag_changes_when_old_content_is_saved_again(client, auth_headers, topic_id):
+    save(client, auth_headers, topic_id, html_content="<p>A</p>")
+    etag_v1 = get(client, auth_headers, topic_id).headers["ETag"]
+    save(client, auth_headers, topic_id, html_content="<p>B</p>")
+    save(client, auth_headers, topic_id, html_content="<p>A</p>")
+
+    response = get(client, auth_headers, topic_id, etag_v1)
+    assert response.status_code == 200
+    assert response.get_json()["version"] == 3
+    assert response.headers["ETag"] != etag_v1
+
+
+def test_gzip_body_matches_plain_body(client, auth_headers, topic_id):
+    save(client, auth_headers, topic_id, html_content="<p>zipped</p>")
+    response = client.get(
+        f"/api/get_webpage?user_id=1&topic_id={topic_id}", headers={**auth_headers, "Accept-Encoding": "gzip"}
+    )
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(response.data)) == {"html_content": "<p>zipped</p>", "version": 1}
+
+
+def test_missing_page_is_not_found(client, auth_headers, topic_id):
+    assert get(client, auth_headers, topic_id).status_code == 404
+
+
+def test_history_is_pruned_to_recent_snapshots(topic_id, monkeypatch):
+    monkeypatch.setattr(pages, "COMPACT_EVERY", 2)
+    for i in range(1, 16):
+        pages.save(1, topic_id, html_content=f"<p>{i}</p>")
+    versions = [entry["version"] for entry in pages.history(1, topic_id)]
+    snapshots = [entry["version"] for entry in pages.history(1, topic_id) if entry["kind"] == "snapshot"]
+    assert len(snapshots) == pages.HISTORY_SNAPSHOTS
+    assert min(versions) == min(snapshots)
+    # Every kept version can still be rebuilt
+    pages.reconstructed.clear()
+    for version in versions:
+        assert pages.load_html(1, topic_id, version) == (f"<p>{version}</p>", version)
+    conn = db.get_connection()
+    webpage_id = pages.get_page(conn, 1, topic_id)[0]
+    assert conn.execute(
+        "SELECT COUNT(*) FROM webpage_deltas WHERE webpage_id = ? AND version < ?", (webpage_id, min(snapshots))
+    ).fetchone()[0] == 0
@@ -0,0 +1,86 @@
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from botocore.exceptions import ClientError
+
+import html_pipeline
+import publish
+
+
+# In-memory stand-in for the S3 calls publish.py makes
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.puts = []
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = {"Body": Body, **kwargs}
+        self.puts.append(Key)
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        body = self.objects[Key]["Body"]
+        return {"Body": type("Body", (), {"read": lambda _: body})()}
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {"Metadata": self.objects[Key].get("Metadata", {})}
+
+
+@pytest.fixture
+def s3():
+    return FakeS3()
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        yield pool
+
+
+def published(s3, user_id, topic_id):
+    return gzip.decompress(s3.objects[publish.page_key(user_id, topic_id)]["Body"]).decode("utf-8")
+
+
+def test_pages_are_transformed_and_recorded_in_the_manifest(s3, executor):
+    pages = {1: "<html><head><style>p { color: red }", 2: "<p>Click <svg></svg> here</p>\n"}
+    results = publish.publish_pages(s3, "bucket", executor, "u", pages, transform=html_pipeline.HtmlPipeline())
+    assert {r["status"] for r in results.values()} == {"uploaded"}
+    assert published(s3, "u", 1) == "<html><head><style>p{color:red}"
+    assert published(s3, "u", 2) == "<p>Click <svg></svg> here</p>"
+    manifest = json.loads(s3.objects[publish.manifest_key("u")]["Body"])
+    assert set(manifest["pages"]) == {"1", "2"}
+
+
+def test_unchanged_pages_are_skipped_until_the_transform_changes(s3, executor, monkeypatch):
+    pages = {1: "<p>a</p>"}
+    publish.publish_pages(s3, "bucket", executor, "u", pages, transform=html_pipeline.HtmlPipeline())
+    s3.puts.clear()
+    results = publish.publish_pages(s3, "bucket", executor, "u", pages, transform=html_pipeline.HtmlPipeline())
+    assert results["1"]["status"] == "unchanged" and s3.puts == []
+
+    monkeypatch.setattr(html_pipeline.HtmlPipeline, "version", "next")
+    results = publish.publish_pages(s3, "bucket", executor, "u", pages, transform=html_pipeline.HtmlPipeline())
+    assert results["1"]["status"] == "uploaded"
+
+
+def test_pages_missing_from_the_manifest_are_checked_against_object_metadata(s3, executor):
+    pages = {1: "<p>a</p>"}
+    publish.publish_pages(s3, "bucket", executor, "u", pages)
+    del s3.objects[publish.manifest_key("u")]
+    s3.puts.clear()
+    results = publish.publish_pages(s3, "bucket", executor, "u", pages)
+    assert results["1"]["status"] == "unchanged"
+    assert s3.puts == [publish.manifest_key("u")]
+
+
+@pytest.mark.parametrize("topic_ids", ["12", [1, "2"], {"1": True}, 5])
+def test_publish_route_rejects_malformed_topic_ids(client, auth_headers, topic_ids):
+    body = {"user_id": "u", "topic_ids": topic_ids}
+    response = client.post("/api/publish", json=body, headers=auth_headers)
+    assert response.status_code == 400
+    assert "topic_ids" in response.get_json()["error"]
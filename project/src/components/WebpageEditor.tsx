@@ -26,6 +26,8 @@ function WebpageEditor() {
   const [modifyPrompt, setModifyPrompt] = useState("");
   const [sharePlatform, setSharePlatform] = useState<string | null>(null); // For share dropdown
   const fileInputRef = useRef<HTMLInputElement>(null); // Ref for file input
+  const savedHtmlRef = useRef<string | null>(null); // Last saved document, base for patch saves
+  const savedVersionRef = useRef<number | null>(null); // Server version of savedHtmlRef
   const API_URL = import.meta.env.VITE_API_URL || "http://localhost:5000/api";
   useEffect(() => {
     if (userId && topicId) {
@@ -62,6 +64,8 @@ function WebpageEditor() {
         setWebpageContent(`<div class="max-w-4xl mx-auto px-4 py-8"><h1 class="text-4xl font-bold mb-6">Untitled</h1><div class="prose prose-lg">Start editing...</div></div>`);
         toast.info("No saved webpage content found, starting with default.");
       } else if (response.data.html_content) {
+        savedHtmlRef.current = response.data.html_content;
+        savedVersionRef.current = response.data.version ?? null;
         setWebpageContent(response.data.html_content);
         toast.success("Webpage content loaded successfully!");
       }
@@ -287,18 +291,38 @@ function WebpageEditor() {
     }
     return "";
   };
+  // Single replace operation between the common prefix and suffix of two documents
+  const diffHtml = (oldHtml: string, newHtml: string) => {
+    const limit = Math.min(oldHtml.length, newHtml.length);
+    let prefix = 0;
+    while (prefix < limit && oldHtml[prefix] === newHtml[prefix]) prefix++;
+    // Don't split a surrogate pair
+    if (prefix > 0 && /[\uD800-\uDBFF]/.test(oldHtml[prefix - 1])) prefix--;
+    let suffix = 0;
+    while (suffix < limit - prefix && oldHtml[oldHtml.length - 1 - suffix] === newHtml[newHtml.length - 1 - suffix]) suffix++;
+    if (suffix > 0 && /[\uDC00-\uDFFF]/.test(oldHtml[oldHtml.length - suffix])) suffix--;
+    if (prefix === oldHtml.length && prefix === newHtml.length) return [];
+    return [{ start: prefix, end: oldHtml.length - suffix, text: newHtml.slice(prefix, newHtml.length - suffix) }];
+  };
   const saveWebpage = async () => {
     if (!editor) return;
     const htmlContent = editor.getHtml();
     const fullHtml = `<!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0"><title>${blogContent?.title || "Webpage"}</title><style>${editor.getCss()}</style></head><body>${htmlContent}</body></html>`;
+    // Send only the changed range when we know which version the server has
+    const body =
+      savedHtmlRef.current !== null && savedVersionRef.current !== null
+        ? { user_id: userId, topic_id: topicId, patch: diffHtml(savedHtmlRef.current, fullHtml), base_version: savedVersionRef.current }
+        : { user_id: userId, topic_id: topicId, html_content: fullHtml };
     try {
       setIsLoading(true);
       const response = await axios.post(
         `${API_URL}/save_webpage`,
-        { user_id: userId, topic_id: topicId, html_content: fullHtml },
+        body,
         { headers: { Authorization: `Bearer ${localStorage.getItem("token")}` } }
       );
       if (response.data.success) {
+        savedHtmlRef.current = fullHtml;
+        savedVersionRef.current = response.data.version ?? null;
         setWebpageContent(fullHtml); // Update state with saved content
         toast.success("Webpage saved successfully!");
       } else {
@@ -306,7 +330,11 @@ function WebpageEditor() {
       }
     } catch (error) {
       console.error("Save webpage error:", error);
-      toast.error("Error saving webpage");
+      if (error.response?.status === 409) {
+        toast.error("This webpage was changed elsewhere. Reload to get the latest version before saving.");
+      } else {
+        toast.error("Error saving webpage");
+      }
     } finally {
       setIsLoading(false);
     }